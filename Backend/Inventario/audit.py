@@ -0,0 +1,268 @@
+"""
+Append-only audit log for product and supplier changes.
+
+Callers only pack a record and hand it to a queue; a background thread writes
+batches to the current segment file and fsyncs once per batch. Segments are
+rotated by size and named in order, so they are also ordered by time.
+
+Each batch goes out in a single ``O_APPEND`` write, so several worker processes
+can share the directory; a writer moves on as soon as another one has rotated.
+
+Record layout (little endian), repeated until end of segment::
+
+    uint32  length of everything after this field
+    float64 unix timestamp
+    int64   entity id
+    uint8   action (1 create, 2 update, 3 delete)
+    uint8   length of the entity name
+    bytes   entity name (ascii)
+    bytes   JSON object {field: [before, after]}
+"""
+import json
+import logging
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+from typing import Iterator, List, Optional
+
+RECORD_HEADER = struct.Struct("<IdqBB")
+LENGTH_FIELD = struct.Struct("<I")
+ACTIONS = {"create": 1, "update": 2, "delete": 3}
+ACTION_NAMES = {code: name for name, code in ACTIONS.items()}
+SEGMENT_PREFIX = "audit-"
+SEGMENT_SUFFIX = ".log"
+# With several writer processes, a segment may end slightly after the next one begins.
+SEGMENT_OVERLAP_SECONDS = 5.0
+
+logger = logging.getLogger(__name__)
+
+
+def snapshot(obj) -> dict:
+    """Column values of a model instance, suitable for ``AuditLog.record``."""
+    return {c.name: getattr(obj, c.name) for c in obj.__table__.columns}
+
+
+def diff(before: Optional[dict], after: Optional[dict]) -> dict:
+    before = before or {}
+    after = after or {}
+    changes = {}
+    for key in before.keys() | after.keys():
+        old, new = before.get(key), after.get(key)
+        if old != new:
+            changes[key] = [old, new]
+    return changes
+
+
+def pack_record(timestamp: float, entity: str, entity_id: int, action: str, changes: dict) -> bytes:
+    name = entity.encode("ascii")
+    body = json.dumps(changes, separators=(",", ":"), default=str).encode("utf-8")
+    length = RECORD_HEADER.size - LENGTH_FIELD.size + len(name) + len(body)
+    return RECORD_HEADER.pack(length, timestamp, entity_id, ACTIONS[action], len(name)) + name + body
+
+
+def _segment_paths(directory: str) -> List[str]:
+    if not os.path.isdir(directory):
+        return []
+    names = sorted(n for n in os.listdir(directory) if n.startswith(SEGMENT_PREFIX) and n.endswith(SEGMENT_SUFFIX))
+    return [os.path.join(directory, n) for n in names]
+
+
+class AuditLog:
+    def __init__(self, directory: str, segment_bytes: int = 8 * 1024 * 1024, max_batch: int = 512):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_batch = max_batch
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._fd: Optional[int] = None
+        self._segment_number = 0
+
+    def start(self):
+        if self._thread:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        segments = _segment_paths(self.directory)
+        if segments:
+            last = os.path.basename(segments[-1])
+            self._segment_number = int(last[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+        if segments and os.path.getsize(segments[-1]) == 0:
+            self._open_segment()
+        else:
+            # Never append after a previous run's tail, which may be a torn record.
+            self._rotate()
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def record(self, entity: str, entity_id: int, action: str, before: Optional[dict] = None, after: Optional[dict] = None):
+        """Queue a change; returns immediately. Updates that change nothing are dropped."""
+        changes = diff(before, after)
+        if action == "update" and not changes:
+            return
+        self._queue.put(pack_record(time.time(), entity, entity_id, action, changes))
+
+    def flush(self, timeout: Optional[float] = None):
+        """Block until everything queued so far is on disk."""
+        if not self._thread:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        if not self._thread:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _segment_path(self) -> str:
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{self._segment_number:06d}{SEGMENT_SUFFIX}")
+
+    def _open_segment(self):
+        self._fd = os.open(self._segment_path(), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def _rotate(self):
+        if self._fd is not None:
+            fd, self._fd = self._fd, None
+            os.close(fd)
+        self._segment_number += 1
+        self._open_segment()
+
+    def _follow_rotation(self):
+        next_path = os.path.join(self.directory, f"{SEGMENT_PREFIX}{self._segment_number + 1:06d}{SEGMENT_SUFFIX}")
+        while os.path.exists(next_path):
+            self._rotate()
+            next_path = os.path.join(self.directory, f"{SEGMENT_PREFIX}{self._segment_number + 1:06d}{SEGMENT_SUFFIX}")
+
+    def _write(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            written = os.write(self._fd, view)
+            view = view[written:]
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            waiters = []
+            records = []
+            for item in batch:
+                if item is None:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    records.append(item)
+            try:
+                if records:
+                    self._write_batch(records)
+            except OSError:
+                # Disk full or gone: drop this batch but keep the writer alive so
+                # callers never wait on a dead thread.
+                logger.exception("audit log: could not write %d records to %s", len(records), self._segment_path())
+                self._recover()
+            finally:
+                for waiter in waiters:
+                    waiter.set()
+
+    def _write_batch(self, records: List[bytes]):
+        if self._fd is None:
+            self._rotate()
+        self._follow_rotation()
+        self._write(b"".join(records))
+        os.fsync(self._fd)
+        if os.fstat(self._fd).st_size >= self.segment_bytes:
+            self._rotate()
+
+    def _recover(self):
+        # The failed write may have left a partial record; continue in a new segment.
+        try:
+            self._rotate()
+        except OSError:
+            self._fd = None  # retried with the next batch
+
+
+class AuditReader:
+    """Scans segments through mmap, decoding only records that match the filters."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def query(self, entity: Optional[str] = None, entity_id: Optional[int] = None,
+              since: Optional[float] = None, until: Optional[float] = None) -> List[dict]:
+        return list(self._iter(entity, entity_id, since, until))
+
+    def _iter(self, entity, entity_id, since, until) -> Iterator[dict]:
+        try:
+            wanted_name = entity.encode("ascii") if entity else None
+        except UnicodeEncodeError:
+            return  # entity names are ascii, so nothing can match
+        segments = _segment_paths(self.directory)
+        first_times = [self._first_timestamp(path) for path in segments]
+        for i, path in enumerate(segments):
+            if first_times[i] is None:
+                continue
+            if until is not None and first_times[i] > until:
+                break
+            next_first = first_times[i + 1] if i + 1 < len(segments) else None
+            if since is not None and next_first is not None and next_first < since - SEGMENT_OVERLAP_SECONDS:
+                continue
+            with open(path, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    yield from self._scan(data, wanted_name, entity_id, since, until)
+
+    @staticmethod
+    def _first_timestamp(path: str) -> Optional[float]:
+        with open(path, "rb") as f:
+            head = f.read(RECORD_HEADER.size)
+        if len(head) < RECORD_HEADER.size:
+            return None
+        return RECORD_HEADER.unpack(head)[1]
+
+    @staticmethod
+    def _scan(data, wanted_name, entity_id, since, until) -> Iterator[dict]:
+        size = len(data)
+        offset = 0
+        while offset + RECORD_HEADER.size <= size:
+            length, ts, rec_id, action, name_len = RECORD_HEADER.unpack_from(data, offset)
+            end = offset + LENGTH_FIELD.size + length
+            if end > size:
+                break  # record still being written
+            name_start = offset + RECORD_HEADER.size
+            body_start = name_start + name_len
+            if body_start > end:
+                break  # corrupt header; the rest of the segment can't be framed
+            if (
+                (since is None or ts >= since)
+                and (until is None or ts <= until)
+                and (entity_id is None or rec_id == entity_id)
+                and (wanted_name is None or data[name_start:body_start] == wanted_name)
+            ):
+                try:
+                    entry = {
+                        "timestamp": ts,
+                        "entity": data[name_start:body_start].decode("ascii"),
+                        "entity_id": rec_id,
+                        "action": ACTION_NAMES.get(action, str(action)),
+                        "changes": json.loads(data[body_start:end]),
+                    }
+                except ValueError:
+                    entry = None
+                # Damaged records are skipped rather than failing the whole query
+                if entry is not None and isinstance(entry["changes"], dict):
+                    yield entry
+            offset = end
+
+
+audit_log = AuditLog(os.environ.get("AUDIT_DIR", "./audit"))
@@ -0,0 +1,350 @@
+"""
+Online backups and compressed snapshots of the SQLite database.
+
+Backups use SQLite's incremental backup API: a few pages are copied per step and
+the copier sleeps between steps, so request handlers keep getting the database
+in between. Can also be run from the command line::
+
+    python backup.py backup [target.db]
+    python backup.py export snapshot.db.gz
+    python backup.py restore snapshot.db.gz
+"""
+import argparse
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import DBAPIError
+
+from database import engine
+import migrations
+
+BACKUP_DIR = os.environ.get("BACKUP_DIR", "./backups")
+DEFAULT_PAGES = 256
+DEFAULT_SLEEP = 0.005
+# After this many restarts caused by concurrent writes, copy the rest in one step.
+MAX_RESTARTS = 5
+LOCK_TIMEOUT = 30
+
+
+class BackupError(Exception):
+    pass
+
+
+class _Restarted(Exception):
+    pass
+
+
+def database_path() -> str:
+    if engine.url.get_backend_name() != "sqlite":
+        raise BackupError("Online backups are only available for SQLite databases")
+    return engine.url.database
+
+
+class BackupJob:
+    def __init__(self, target: str, pages: int = DEFAULT_PAGES, sleep: float = DEFAULT_SLEEP):
+        self.id = uuid.uuid4().hex
+        self.target = target
+        self.pages = pages
+        self.sleep = sleep
+        self.status = "pending"
+        self.error: Optional[str] = None
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.pages_total = 0
+        self.pages_remaining = 0
+        self.restarts = 0
+        self.steps: List[dict] = []
+
+    def run(self, on_step: Optional[Callable[["BackupJob"], None]] = None):
+        self.status = "running"
+        self.started_at = self.started_at or datetime.utcnow()
+        try:
+            copy_database(database_path(), self.target, self, on_step)
+            self.status = "done"
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+        finally:
+            self.finished_at = datetime.utcnow()
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "target": self.target,
+            "status": self.status,
+            "error": self.error,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "pages_total": self.pages_total,
+            "pages_remaining": self.pages_remaining,
+            "restarts": self.restarts,
+            "steps": self.steps,
+        }
+
+    def save(self):
+        """Write the job status next to the backups, so every worker process can report it."""
+        data = self.to_dict()
+        for key in ("started_at", "finished_at"):
+            data[key] = data[key].isoformat() if data[key] else None
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        path = _status_path(self.id)
+        with open(path + ".tmp", "w") as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
+
+
+def copy_database(source_path: str, target_path: str, job: BackupJob, on_step=None):
+    """Copy ``source_path`` to ``target_path`` page-step by page-step, recording timing in ``job``."""
+    tmp_path = target_path + ".partial"
+    src = sqlite3.connect(source_path, timeout=LOCK_TIMEOUT)
+    dst = sqlite3.connect(tmp_path)
+    last_step = time.perf_counter()
+
+    def progress(status, remaining, total):
+        nonlocal last_step
+        now = time.perf_counter()
+        if job.steps and remaining > job.pages_remaining:
+            # A writer changed the source; SQLite starts the copy over.
+            job.restarts += 1
+            if job.restarts > MAX_RESTARTS:
+                raise _Restarted()
+        job.pages_total = total
+        job.pages_remaining = remaining
+        job.steps.append({"remaining": remaining, "total": total, "seconds": round(now - last_step, 6)})
+        if on_step:
+            on_step(job)
+        if remaining and job.sleep:
+            time.sleep(job.sleep)
+        last_step = time.perf_counter()
+
+    try:
+        try:
+            src.backup(dst, pages=job.pages, progress=progress)
+        except _Restarted:
+            src.backup(dst, pages=-1, progress=progress)
+    except Exception:
+        dst.close()
+        os.remove(tmp_path)
+        raise
+    finally:
+        dst.close()
+        src.close()
+    os.replace(tmp_path, target_path)
+
+
+_jobs: Dict[str, BackupJob] = {}
+_jobs_lock = threading.Lock()
+
+
+def default_target() -> str:
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    return os.path.join(BACKUP_DIR, f"inventory-{datetime.utcnow():%Y%m%d-%H%M%S-%f}.db")
+
+
+def _status_path(job_id: str) -> str:
+    return os.path.join(BACKUP_DIR, f"{job_id}.json")
+
+
+def start_backup(pages: int = DEFAULT_PAGES, sleep: float = DEFAULT_SLEEP, target: Optional[str] = None) -> BackupJob:
+    """Start a backup in a background thread and return its job for progress polling."""
+    database_path()
+    job = BackupJob(target or default_target(), pages, sleep)
+    job.status = "running"
+    job.started_at = datetime.utcnow()
+    job.save()
+    with _jobs_lock:
+        _jobs[job.id] = job
+
+    def run():
+        job.run()
+        job.save()
+
+    threading.Thread(target=run, name=f"backup-{job.id}", daemon=True).start()
+    return job
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    """Status of a job started by this process (live) or by another worker (last saved)."""
+    job = _jobs.get(job_id)
+    if job:
+        return job.to_dict()
+    if not job_id.isalnum():
+        return None
+    try:
+        with open(_status_path(job_id)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def list_jobs() -> List[dict]:
+    jobs = {}
+    if os.path.isdir(BACKUP_DIR):
+        for name in os.listdir(BACKUP_DIR):
+            if name.endswith(".json"):
+                job = get_job(name[:-len(".json")])
+                if job:
+                    jobs[job["id"]] = job
+    jobs.update((job_id, job.to_dict()) for job_id, job in _jobs.items())
+    return sorted(jobs.values(), key=lambda j: str(j["started_at"] or ""), reverse=True)
+
+
+def export_snapshot(target_path: str, pages: int = DEFAULT_PAGES, sleep: float = DEFAULT_SLEEP, on_step=None) -> BackupJob:
+    """Write a gzip-compressed, consistent copy of the database to ``target_path``."""
+    fd, tmp_db = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    job = BackupJob(tmp_db, pages, sleep)
+    try:
+        job.run(on_step)
+        if job.status != "done":
+            raise BackupError(job.error)
+        with open(tmp_db, "rb") as raw, gzip.open(target_path, "wb", compresslevel=6) as out:
+            shutil.copyfileobj(raw, out, 1024 * 1024)
+    finally:
+        if os.path.exists(tmp_db):
+            os.remove(tmp_db)
+    job.target = target_path
+    return job
+
+
+def _sync_versions(path: str) -> Dict[str, int]:
+    conn = sqlite3.connect(path, timeout=LOCK_TIMEOUT)
+    try:
+        return dict(conn.execute("SELECT name, version FROM sync_state"))
+    except sqlite3.OperationalError:
+        return {}  # from before sync_state existed
+    finally:
+        conn.close()
+
+
+def _prepare_snapshot(tmp_db: str, live_path: str):
+    """Bring a decompressed snapshot up to the current schema and sync counters."""
+    snapshot_engine = create_engine(f"sqlite:///{tmp_db}")
+    try:
+        known = {version for version, _, _ in migrations.MIGRATIONS}
+        if set(migrations.applied_versions(snapshot_engine)) - known:
+            raise BackupError("Snapshot was taken by a newer version of the app")
+        migrations.upgrade(snapshot_engine)
+    except DBAPIError as e:
+        raise BackupError(f"Snapshot could not be migrated: {e.orig}")
+    finally:
+        snapshot_engine.dispose()
+    # Move the counters past both the live and the snapshot values, so every
+    # worker notices the restore and reloads its caches.
+    live = _sync_versions(live_path)
+    restored = _sync_versions(tmp_db)
+    conn = sqlite3.connect(tmp_db)
+    try:
+        for name in ("catalog", "restore"):
+            version = max(live.get(name, 0), restored.get(name, 0)) + 1
+            conn.execute("INSERT OR REPLACE INTO sync_state (name, version) VALUES (?, ?)", (name, version))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def restore_snapshot(snapshot_path: str, on_step=None) -> BackupJob:
+    """Replace the live database contents with a gzip snapshot.
+
+    The snapshot is decompressed, integrity-checked and migrated to the current
+    schema first; the live database is then overwritten through the backup API,
+    which takes SQLite's own locks so concurrent requests wait instead of reading
+    a half-copied file.
+    """
+    live_path = database_path()
+    fd, tmp_db = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        try:
+            with gzip.open(snapshot_path, "rb") as raw, open(tmp_db, "wb") as out:
+                shutil.copyfileobj(raw, out, 1024 * 1024)
+        except (OSError, EOFError) as e:
+            raise BackupError(f"Not a gzip snapshot: {e}")
+        check = sqlite3.connect(tmp_db)
+        try:
+            if check.execute("PRAGMA integrity_check").fetchone()[0] != "ok":
+                raise BackupError("Snapshot failed integrity check")
+            tables = {r[0] for r in check.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        except sqlite3.DatabaseError as e:
+            raise BackupError(f"Not a SQLite snapshot: {e}")
+        finally:
+            check.close()
+        if "products" not in tables:
+            raise BackupError("Snapshot is not an inventory database")
+        _prepare_snapshot(tmp_db, live_path)
+
+        job = BackupJob(live_path, pages=-1, sleep=0)
+        job.status = "running"
+        job.started_at = datetime.utcnow()
+        src = sqlite3.connect(tmp_db)
+        dst = sqlite3.connect(live_path, timeout=LOCK_TIMEOUT)
+        start = time.perf_counter()
+
+        def progress(status, remaining, total):
+            job.pages_total = total
+            job.pages_remaining = remaining
+
+        try:
+            src.backup(dst, pages=-1, progress=progress)
+        finally:
+            dst.close()
+            src.close()
+        job.steps.append({"remaining": 0, "total": job.pages_total, "seconds": round(time.perf_counter() - start, 6)})
+        job.status = "done"
+        job.finished_at = datetime.utcnow()
+        if on_step:
+            on_step(job)
+    finally:
+        os.remove(tmp_db)
+    # Pooled connections may hold pages cached from the old file.
+    engine.dispose()
+    return job
+
+
+def _print_step(job: BackupJob):
+    done = job.pages_total - job.pages_remaining
+    print(f"{done}/{job.pages_total} pages ({job.steps[-1]['seconds'] * 1000:.2f} ms)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Online backup and snapshot tool for inventory.db")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_backup = sub.add_parser("backup", help="copy the database to a .db file")
+    p_backup.add_argument("target", nargs="?")
+    p_export = sub.add_parser("export", help="write a gzip-compressed snapshot")
+    p_export.add_argument("target")
+    p_restore = sub.add_parser("restore", help="replace the database with a gzip snapshot")
+    p_restore.add_argument("snapshot")
+    for p in (p_backup, p_export):
+        p.add_argument("--pages", type=int, default=DEFAULT_PAGES, help="pages copied per step")
+        p.add_argument("--sleep", type=float, default=DEFAULT_SLEEP, help="seconds to pause between steps")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    if args.command == "backup":
+        job = BackupJob(args.target or default_target(), args.pages, args.sleep)
+        job.run(_print_step)
+        if job.status != "done":
+            raise SystemExit(f"Backup failed: {job.error}")
+    elif args.command == "export":
+        job = export_snapshot(args.target, args.pages, args.sleep, _print_step)
+    else:
+        from workers import write_lock
+        # Keep a running server's writers out while the data is replaced.
+        with write_lock.hold_sync():
+            job = restore_snapshot(args.snapshot, _print_step)
+    print(f"{args.command} to {job.target} finished in {time.perf_counter() - start:.3f}s, {job.restarts} restarts")
+
+
+if __name__ == "__main__":
+    main()
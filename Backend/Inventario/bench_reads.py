@@ -0,0 +1,118 @@
+"""
+Read throughput benchmark for multi-worker deployments.
+
+Starts ``serve.py`` with each worker count on a scratch database, seeds some
+products and hammers ``GET /api/products/{id}`` from several client processes:
+
+    python bench_reads.py --workers 1 2 4 --duration 10
+
+Prints requests per second and latency percentiles for each worker count.
+Throughput only scales up to the number of CPU cores available to the server
+and the load generator together.
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _wait_ready(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/api/products")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+def _seed(port, count):
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    ids = []
+    for i in range(count):
+        body = json.dumps({"sku": f"BENCH{i:05d}", "name": f"Bench product {i}", "sale_price": 10.0})
+        conn.request("POST", "/api/products", body, {"Content-Type": "application/json"})
+        ids.append(json.loads(conn.getresponse().read())["id"])
+    return ids
+
+
+def _client(args):
+    port, ids, duration = args
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    latencies = []
+    end = time.perf_counter() + duration
+    while True:
+        start = time.perf_counter()
+        if start >= end:
+            break
+        conn.request("GET", f"/api/products/{random.choice(ids)}")
+        conn.getresponse().read()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run(workers, port, clients, duration, products):
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        AUDIT_DIR=os.path.join(workdir, "audit"),
+        BACKUP_DIR=os.path.join(workdir, "backups"),
+    )
+    server = subprocess.Popen(
+        [sys.executable, "serve.py", "--workers", str(workers), "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=HERE, env=env,
+    )
+    try:
+        _wait_ready(port)
+        ids = _seed(port, products)
+        with multiprocessing.Pool(clients) as pool:
+            results = pool.map(_client, [(port, ids, duration)] * clients)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+        shutil.rmtree(workdir, ignore_errors=True)
+    latencies = sorted(l for r in results for l in r)
+    return {
+        "workers": workers,
+        "requests": len(latencies),
+        "rps": len(latencies) / duration,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+
+
+def main(argv=None):
+    cpus = os.cpu_count() or 1
+    default_workers = sorted({1, 2, 4, cpus} & set(range(1, cpus + 1))) or [1]
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=default_workers)
+    parser.add_argument("--clients", type=int, default=max(4, cpus * 2), help="load generator processes")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per run")
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--port", type=int, default=8890)
+    args = parser.parse_args(argv)
+
+    print(f"{cpus} CPUs, {args.clients} client processes, {args.duration:.0f}s per run")
+    print(f"{'workers':>8} {'requests':>10} {'req/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for workers in args.workers:
+        r = run(workers, args.port, args.clients, args.duration, args.products)
+        print(f"{r['workers']:>8} {r['requests']:>10} {r['rps']:>10.0f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
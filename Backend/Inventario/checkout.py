@@ -0,0 +1,170 @@
+"""
+Checkout helpers: in-memory barcode index and single-transaction ticket commit.
+
+The register resolves every scan through ``barcode_index`` (no database round
+trip) and only touches the database once per ticket, when the grouped lines are
+committed as one sale transaction.
+"""
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional
+
+from sqlalchemy.orm import Session
+
+import models
+
+
+class ScanEntry(NamedTuple):
+    product_id: int
+    sku: str
+    name: str
+    sale_price: float
+
+
+class CheckoutError(Exception):
+    """Raised when a ticket can't be committed; carries the HTTP status to return."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class BarcodeIndex:
+    """Maps SKUs and alternate barcodes to a small product snapshot."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_code: Dict[str, ScanEntry] = {}
+        self._entries: Dict[int, ScanEntry] = {}
+        self._alternates: Dict[int, set] = {}
+
+    def load(self, db: Session):
+        entries = {}
+        alternates = {}
+        for p in db.query(models.Product).all():
+            entries[p.id] = ScanEntry(p.id, p.sku, p.name, p.sale_price or 0.0)
+            alternates[p.id] = set()
+        for b in db.query(models.ProductBarcode).all():
+            if b.product_id in alternates:
+                alternates[b.product_id].add(b.barcode)
+        by_code = {}
+        for product_id, entry in entries.items():
+            by_code[entry.sku] = entry
+            for code in alternates[product_id]:
+                by_code[code] = entry
+        with self._lock:
+            self._by_code = by_code
+            self._entries = entries
+            self._alternates = alternates
+
+    def lookup(self, code: str) -> Optional[ScanEntry]:
+        return self._by_code.get(code)
+
+    def put_product(self, product: models.Product):
+        """Index a new product, or refresh the snapshot after an edit (SKU may change)."""
+        entry = ScanEntry(product.id, product.sku, product.name, product.sale_price or 0.0)
+        with self._lock:
+            old = self._entries.get(product.id)
+            if old:
+                self._by_code.pop(old.sku, None)
+            self._entries[product.id] = entry
+            self._by_code[entry.sku] = entry
+            for code in self._alternates.setdefault(product.id, set()):
+                self._by_code[code] = entry
+
+    def add_barcode(self, product_id: int, code: str):
+        with self._lock:
+            entry = self._entries.get(product_id)
+            if entry:
+                self._alternates[product_id].add(code)
+                self._by_code[code] = entry
+
+    def remove_barcode(self, code: str):
+        with self._lock:
+            entry = self._by_code.get(code)
+            if entry and entry.sku != code:
+                del self._by_code[code]
+                self._alternates[entry.product_id].discard(code)
+
+    def remove_product(self, product_id: int):
+        with self._lock:
+            entry = self._entries.pop(product_id, None)
+            if entry:
+                self._by_code.pop(entry.sku, None)
+            for code in self._alternates.pop(product_id, set()):
+                self._by_code.pop(code, None)
+
+
+barcode_index = BarcodeIndex()
+
+
+class Ticket:
+    """Line items scanned during one WebSocket checkout session."""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.lines: "OrderedDict[int, list]" = OrderedDict()  # product_id -> [entry, quantity]
+
+    def add(self, entry: ScanEntry, quantity: int):
+        line = self.lines.get(entry.product_id)
+        if line:
+            line[1] += quantity
+        else:
+            self.lines[entry.product_id] = [entry, quantity]
+        if self.lines[entry.product_id][1] <= 0:
+            del self.lines[entry.product_id]
+
+    def quantities(self) -> Dict[int, int]:
+        return {pid: qty for pid, (_, qty) in self.lines.items()}
+
+    def summary(self) -> dict:
+        items = [
+            {"product_id": e.product_id, "sku": e.sku, "name": e.name, "quantity": qty, "unit_price": e.sale_price}
+            for e, qty in self.lines.values()
+        ]
+        total = sum(i["quantity"] * i["unit_price"] for i in items)
+        return {"ticket_id": self.id, "items": items, "total": round(total, 2)}
+
+
+def commit_sale(db: Session, quantities: Dict[int, int], ticket_id: str) -> List[dict]:
+    """Record every line of a ticket as sale movements in a single transaction.
+
+    Either all lines are applied or none: stock is checked for every product
+    before anything is written.
+    """
+    if not quantities:
+        raise CheckoutError(400, "Ticket has no items")
+    # Lock in id order, like receipts, so the two can't deadlock on PostgreSQL
+    products = {
+        p.id: p
+        for p in (
+            db.query(models.Product).with_for_update()
+            .filter(models.Product.id.in_(list(quantities)))
+            .order_by(models.Product.id)
+            .all()
+        )
+    }
+    for product_id, qty in quantities.items():
+        p = products.get(product_id)
+        if not p:
+            raise CheckoutError(404, f"Product {product_id} not found")
+        if qty <= 0:
+            raise CheckoutError(400, "Quantity must be positive")
+        if p.stock - qty < 0:
+            raise CheckoutError(400, f"Insufficient stock for {p.sku}")
+    movements = []
+    for product_id, qty in quantities.items():
+        p = products[product_id]
+        p.stock = p.stock - qty
+        mv = models.InventoryMovement(product_id=product_id, type="sale", quantity=qty, notes=f"Ticket {ticket_id}")
+        db.add(mv)
+        movements.append(mv)
+    db.flush()
+    lines = [
+        {"movement_id": mv.id, "product_id": mv.product_id, "quantity": mv.quantity, "stock": products[mv.product_id].stock}
+        for mv in movements
+    ]
+    db.commit()
+    return lines
@@ -1,12 +1,59 @@
-from sqlalchemy import create_engine
+import os
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker, declarative_base
 
-DATABASE_URL = "sqlite:///./inventory.db"
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./inventory.db")
+if DATABASE_URL.startswith("postgres://"):
+    DATABASE_URL = "postgresql://" + DATABASE_URL[len("postgres://"):]
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+if IS_SQLITE:
+    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+else:
+    # Sized for uvicorn's threadpool (40 threads): steady connections plus a burst
+    # allowance. LIFO reuse keeps the idle tail small; pre-ping drops connections
+    # the server closed while they sat in the pool.
+    engine = create_engine(
+        DATABASE_URL,
+        pool_size=int(os.environ.get("DB_POOL_SIZE", "10")),
+        max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", "20")),
+        pool_timeout=30,
+        pool_recycle=1800,
+        pool_pre_ping=True,
+        pool_use_lifo=True,
+        executemany_mode="values_plus_batch",
+    )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+
+if IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL lets readers (in every worker) run while a write commits; the busy
+        # timeout makes a second writer wait for the lock instead of failing.
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
+
 def init_db():
     import models
-    Base.metadata.create_all(bind=engine)
+    import migrations
+    from workers import write_lock
+    # Workers started together would otherwise race to create the same tables
+    # on SQLite; PostgreSQL migrations take an advisory lock of their own.
+    with write_lock.hold_sync():
+        migrations.upgrade(engine)
+        db = SessionLocal()
+        if not db.query(models.SyncState).get("catalog"):
+            db.add(models.SyncState(name="catalog", version=0))
+            try:
+                db.commit()
+            except IntegrityError:
+                # Another worker inserted it first
+                db.rollback()
+        db.close()
@@ -0,0 +1,273 @@
+"""
+``Idempotency-Key`` support for write requests.
+
+The first response to a keyed request is kept in a bounded in-memory LRU and
+persisted to the ``idempotency_keys`` table; retries with the same key and
+payload get the stored response back without running the route again.
+
+Before the route runs the key is claimed with a pending row, so a retry that
+reaches another worker process meanwhile is answered with 409.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+
+from database import SessionLocal
+import models
+from workers import write_lock
+
+IDEMPOTENCY_HEADER = b"idempotency-key"
+REPLAYED_HEADER = (b"idempotent-replayed", b"true")
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+MAX_KEY_LENGTH = 255
+# Status of a claimed key whose request is still running
+PENDING_STATUS = 0
+# A claim this old belongs to a worker that died mid-request
+PENDING_TIMEOUT = 300.0
+
+
+class StoredResponse(NamedTuple):
+    fingerprint: str
+    status_code: int
+    headers: list
+    body: bytes
+    created_at: float
+
+
+class IdempotencyStore:
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 24 * 3600, purge_every: int = 500):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.purge_every = purge_every
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, StoredResponse]" = OrderedDict()
+        self._puts = 0
+
+    def get_cached(self, key: str) -> Optional[StoredResponse]:
+        """Memory-only lookup; cheap enough to call on the event loop."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._expired(entry):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def get(self, key: str) -> Optional[StoredResponse]:
+        """Memory lookup with a fallback to the database (restarts, evicted keys)."""
+        entry = self.get_cached(key)
+        if entry is not None:
+            return entry
+        db = SessionLocal()
+        row = db.query(models.IdempotencyKey).get(key)
+        db.close()
+        entry = self._from_row(row)
+        if entry is None or entry.status_code == PENDING_STATUS:
+            return None
+        self._remember(key, entry)
+        return entry
+
+    def claim(self, key: str, fingerprint: str) -> Optional[StoredResponse]:
+        """Reserve ``key`` for a request about to run and return None.
+
+        If the key is taken, returns the stored response instead, or a pending
+        entry (``status_code == PENDING_STATUS``) while another worker runs it.
+        Call with the write lock held; on PostgreSQL, where that lock doesn't span
+        processes, a concurrent claim is detected by the primary key instead.
+        """
+        entry = self.get_cached(key)
+        if entry is not None:
+            return entry
+        db = SessionLocal()
+        try:
+            entry = self._from_row(db.query(models.IdempotencyKey).get(key))
+            if entry is not None and entry.status_code != PENDING_STATUS:
+                self._remember(key, entry)
+                return entry
+            if entry is not None and entry.created_at + PENDING_TIMEOUT > time.time():
+                return entry
+            pending = StoredResponse(fingerprint, PENDING_STATUS, [], b"", time.time())
+            db.merge(self._to_row(key, pending))
+            try:
+                db.commit()
+            except IntegrityError:
+                # Another process claimed the key between our read and insert (the
+                # write lock is per process on PostgreSQL).
+                db.rollback()
+                return self._from_row(db.query(models.IdempotencyKey).get(key)) or pending
+            return None
+        finally:
+            db.close()
+
+    def release(self, key: str):
+        """Drop a claim whose request failed, so it can be retried."""
+        db = SessionLocal()
+        db.query(models.IdempotencyKey).filter_by(key=key, status_code=PENDING_STATUS).delete(synchronize_session=False)
+        db.commit()
+        db.close()
+
+    def put(self, key: str, entry: StoredResponse):
+        self._remember(key, entry)
+        db = SessionLocal()
+        db.merge(self._to_row(key, entry))
+        self._puts += 1
+        if self._puts % self.purge_every == 0:
+            cutoff = time.time() - self.ttl_seconds
+            db.query(models.IdempotencyKey).filter(models.IdempotencyKey.created_at < cutoff).delete(synchronize_session=False)
+        db.commit()
+        db.close()
+
+    def _remember(self, key: str, entry: StoredResponse):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while self._entries:
+                oldest = next(iter(self._entries.values()))
+                if len(self._entries) > self.max_entries or self._expired(oldest):
+                    self._entries.popitem(last=False)
+                else:
+                    break
+
+    def _expired(self, entry: StoredResponse) -> bool:
+        return entry.created_at + self.ttl_seconds < time.time()
+
+    def _from_row(self, row) -> Optional[StoredResponse]:
+        if row is None:
+            return None
+        entry = StoredResponse(row.fingerprint, row.status_code, json.loads(row.headers), bytes(row.body), row.created_at)
+        return None if self._expired(entry) else entry
+
+    @staticmethod
+    def _to_row(key: str, entry: StoredResponse) -> models.IdempotencyKey:
+        return models.IdempotencyKey(
+            key=key,
+            fingerprint=entry.fingerprint,
+            status_code=entry.status_code,
+            headers=json.dumps(entry.headers),
+            body=entry.body,
+            created_at=entry.created_at,
+        )
+
+
+idempotency_store = IdempotencyStore()
+
+
+class IdempotencyMiddleware:
+    """ASGI middleware replaying stored responses for repeated ``Idempotency-Key`` requests.
+
+    A key reused with a different method, path or body is rejected with 422, and
+    a retry that arrives while the original is still running gets 409. Server
+    errors (5xx) are not stored, so those requests can be retried.
+    """
+
+    def __init__(self, app, store: IdempotencyStore = idempotency_store):
+        self.app = app
+        self.store = store
+        self._in_flight = set()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in WRITE_METHODS:
+            await self.app(scope, receive, send)
+            return
+        key = dict(scope["headers"]).get(IDEMPOTENCY_HEADER)
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+        key = key.decode("latin-1")
+        if not key or len(key) > MAX_KEY_LENGTH:
+            await JSONResponse({"detail": "Invalid Idempotency-Key"}, status_code=400)(scope, receive, send)
+            return
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+        digest = hashlib.sha256(f"{scope['method']} {scope['path']}?{scope.get('query_string', b'').decode('latin-1')}\n".encode())
+        digest.update(body)
+        fingerprint = digest.hexdigest()
+
+        stored = self.store.get_cached(key)
+        if stored is not None:
+            await self._replay(stored, fingerprint, scope, receive, send)
+            return
+        if key in self._in_flight:
+            await JSONResponse({"detail": "A request with this Idempotency-Key is in progress"}, status_code=409)(scope, receive, send)
+            return
+
+        self._in_flight.add(key)
+        try:
+            # The lock only covers the claim; the route takes it again for its own writes.
+            async with write_lock.hold():
+                stored = await run_in_threadpool(self.store.claim, key, fingerprint)
+            if stored is None:
+                await self._run_and_store(key, fingerprint, body, scope, receive, send)
+            elif stored.status_code == PENDING_STATUS:
+                await JSONResponse({"detail": "A request with this Idempotency-Key is in progress"}, status_code=409)(scope, receive, send)
+            else:
+                await self._replay(stored, fingerprint, scope, receive, send)
+        finally:
+            self._in_flight.discard(key)
+
+    async def _run_and_store(self, key, fingerprint, body, scope, receive, send):
+        replayed_body = False
+
+        async def replay_receive():
+            nonlocal replayed_body
+            if not replayed_body:
+                replayed_body = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        status_code = None
+        headers = []
+        chunks = []
+        messages = []
+
+        async def capture_send(message):
+            nonlocal status_code, headers
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = message.get("headers", [])
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            messages.append(message)
+
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        finally:
+            # Store before answering, so a retry sent right after the response
+            # arrives is replayed rather than refused as in progress.
+            async with write_lock.hold():
+                if status_code is not None and status_code < 500:
+                    entry = StoredResponse(
+                        fingerprint,
+                        status_code,
+                        [[k.decode("latin-1"), v.decode("latin-1")] for k, v in headers],
+                        b"".join(chunks),
+                        time.time(),
+                    )
+                    await run_in_threadpool(self.store.put, key, entry)
+                else:
+                    await run_in_threadpool(self.store.release, key)
+        for message in messages:
+            await send(message)
+
+    async def _replay(self, stored, fingerprint, scope, receive, send):
+        if stored.fingerprint != fingerprint:
+            response = JSONResponse({"detail": "Idempotency-Key was already used with a different request"}, status_code=422)
+            await response(scope, receive, send)
+            return
+        headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in stored.headers]
+        await send({"type": "http.response.start", "status": stored.status_code, "headers": headers + [REPLAYED_HEADER]})
+        await send({"type": "http.response.body", "body": stored.body})
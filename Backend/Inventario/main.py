@@ -2,6 +2,7 @@ from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
+from idempotency import IdempotencyMiddleware
 
 # Create app first, then import routes to avoid import-time side-effects
 app = FastAPI(title="Abarrotes Yamessi - Inventario")
@@ -10,6 +11,9 @@ app = FastAPI(title="Abarrotes Yamessi - Inventario")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
+# Replays stored responses for retried writes carrying an Idempotency-Key header
+app.add_middleware(IdempotencyMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
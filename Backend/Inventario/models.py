@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Text
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Text, LargeBinary
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -16,6 +16,7 @@ class Product(Base):
     stock = Column(Integer, default=0)
 
     movements = relationship("InventoryMovement", back_populates="product")
+    barcodes = relationship("ProductBarcode", back_populates="product", cascade="all, delete-orphan")
 
 
 class Supplier(Base):
@@ -41,3 +42,65 @@ class InventoryMovement(Base):
 
     product = relationship("Product", back_populates="movements")
     supplier = relationship("Supplier", back_populates="movements")
+
+
+class ProductBarcode(Base):
+    __tablename__ = "product_barcodes"
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False, index=True)
+    barcode = Column(String, unique=True, index=True, nullable=False)
+
+    product = relationship("Product", back_populates="barcodes")
+
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    key = Column(String, primary_key=True)
+    fingerprint = Column(String, nullable=False)
+    status_code = Column(Integer, nullable=False)
+    headers = Column(Text, nullable=False)  # JSON list of [name, value]
+    body = Column(LargeBinary, nullable=False)
+    created_at = Column(Float, nullable=False, index=True)  # unix timestamp
+
+
+class PurchaseOrder(Base):
+    __tablename__ = "purchase_orders"
+    id = Column(Integer, primary_key=True, index=True)
+    supplier_id = Column(Integer, ForeignKey("suppliers.id"), nullable=False, index=True)
+    status = Column(String, nullable=False, default="open", index=True)  # open, partial, received
+    created_at = Column(DateTime, default=datetime.utcnow)
+    notes = Column(Text, nullable=True)
+
+    supplier = relationship("Supplier")
+    lines = relationship("PurchaseOrderLine", back_populates="order", cascade="all, delete-orphan")
+    receipts = relationship("GoodsReceipt", back_populates="order", cascade="all, delete-orphan")
+
+
+class PurchaseOrderLine(Base):
+    __tablename__ = "purchase_order_lines"
+    id = Column(Integer, primary_key=True, index=True)
+    order_id = Column(Integer, ForeignKey("purchase_orders.id"), nullable=False, index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    quantity_ordered = Column(Integer, nullable=False)
+    quantity_received = Column(Integer, nullable=False, default=0)
+    unit_cost = Column(Float, default=0.0)
+
+    order = relationship("PurchaseOrder", back_populates="lines")
+    product = relationship("Product")
+
+
+class GoodsReceipt(Base):
+    __tablename__ = "goods_receipts"
+    id = Column(Integer, primary_key=True, index=True)
+    order_id = Column(Integer, ForeignKey("purchase_orders.id"), nullable=False, index=True)
+    date = Column(DateTime, default=datetime.utcnow)
+    notes = Column(Text, nullable=True)
+
+    order = relationship("PurchaseOrder", back_populates="receipts")
+
+
+class SyncState(Base):
+    """Version counters other worker processes poll to know when to drop caches."""
+    __tablename__ = "sync_state"
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
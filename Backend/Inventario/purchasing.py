@@ -0,0 +1,182 @@
+"""
+Purchase orders and goods receipts.
+
+A receipt posts all of its lines at once: one executemany stock update, one
+executemany movement insert and one executemany update of the received
+quantities, all in a single transaction.
+"""
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import bindparam, func
+from sqlalchemy.orm import Session
+
+import models
+
+products_table = models.Product.__table__
+movements_table = models.InventoryMovement.__table__
+lines_table = models.PurchaseOrderLine.__table__
+
+OPEN_STATUSES = ("open", "partial")
+
+
+class PurchasingError(Exception):
+    """Raised when an order or receipt is invalid; carries the HTTP status to return."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def create_order(db: Session, supplier_id: int, lines: List[dict], notes: Optional[str] = None) -> models.PurchaseOrder:
+    if not lines:
+        raise PurchasingError(400, "Order has no lines")
+    if not db.query(models.Supplier).get(supplier_id):
+        raise PurchasingError(404, "Supplier not found")
+    product_ids = {line["product_id"] for line in lines}
+    if len(product_ids) != len(lines):
+        raise PurchasingError(400, "Each product can only appear once per order")
+    found = db.query(func.count(models.Product.id)).filter(models.Product.id.in_(product_ids)).scalar()
+    if found != len(product_ids):
+        raise PurchasingError(404, "Product not found")
+    if any(line["quantity"] <= 0 for line in lines):
+        raise PurchasingError(400, "Quantity must be positive")
+    order = models.PurchaseOrder(supplier_id=supplier_id, notes=notes, status="open")
+    order.lines = [
+        models.PurchaseOrderLine(product_id=line["product_id"], quantity_ordered=line["quantity"],
+                                 quantity_received=0, unit_cost=line.get("unit_cost") or 0.0)
+        for line in lines
+    ]
+    db.add(order)
+    db.commit()
+    db.refresh(order)
+    return order
+
+
+def has_open_lines(db: Session, product_id: int) -> bool:
+    """Whether the product is still expected on an open or partially received order."""
+    return db.query(models.PurchaseOrderLine.id).join(models.PurchaseOrder).filter(
+        models.PurchaseOrderLine.product_id == product_id,
+        models.PurchaseOrder.status.in_(OPEN_STATUSES),
+    ).first() is not None
+
+
+def receive(db: Session, order_id: int, quantities: Optional[Dict[int, int]] = None, notes: Optional[str] = None) -> dict:
+    """Post a goods receipt for an order.
+
+    ``quantities`` maps product id to the quantity delivered; ``None`` receives
+    everything still outstanding. Receiving more than is outstanding is refused.
+    """
+    # Lock the order so concurrent receipts on PostgreSQL check outstanding
+    # quantities one after the other; the lines are read once the lock is held.
+    order = db.query(models.PurchaseOrder).with_for_update().filter_by(id=order_id).first()
+    if not order:
+        raise PurchasingError(404, "Purchase order not found")
+    if order.status not in OPEN_STATUSES:
+        raise PurchasingError(400, "Purchase order is already received")
+    lines = {line.product_id: line for line in order.lines}
+    if quantities is None:
+        quantities = {pid: line.quantity_ordered - line.quantity_received for pid, line in lines.items()}
+        quantities = {pid: qty for pid, qty in quantities.items() if qty > 0}
+    if not quantities:
+        raise PurchasingError(400, "Receipt has no lines")
+    for product_id, qty in quantities.items():
+        line = lines.get(product_id)
+        if not line:
+            raise PurchasingError(400, f"Product {product_id} is not on this order")
+        if qty <= 0:
+            raise PurchasingError(400, "Quantity must be positive")
+        if qty > line.quantity_ordered - line.quantity_received:
+            raise PurchasingError(400, f"Quantity for product {product_id} exceeds what is outstanding")
+    existing = {pid for (pid,) in db.query(models.Product.id).filter(models.Product.id.in_(list(quantities)))}
+    for product_id in quantities:
+        if product_id not in existing:
+            raise PurchasingError(409, f"Product {product_id} has been deleted")
+
+    # Stock rows are updated (and so locked) in product id order, like checkout does.
+    ordered = sorted(quantities.items())
+    receipt = models.GoodsReceipt(order_id=order.id, notes=notes)
+    db.add(receipt)
+    db.flush()
+    tag = f"PO {order.id} receipt {receipt.id}"
+    now = datetime.utcnow()
+    last_movement_id = db.query(func.max(models.InventoryMovement.id)).scalar() or 0
+
+    db.execute(
+        products_table.update()
+        .where(products_table.c.id == bindparam("pid"))
+        .values(stock=products_table.c.stock + bindparam("qty")),
+        [{"pid": pid, "qty": qty} for pid, qty in ordered],
+    )
+    db.execute(
+        movements_table.insert(),
+        [
+            {"product_id": pid, "type": "entry", "quantity": qty, "date": now,
+             "supplier_id": order.supplier_id, "notes": tag}
+            for pid, qty in ordered
+        ],
+    )
+    db.execute(
+        lines_table.update()
+        .where(lines_table.c.id == bindparam("lid"))
+        .values(quantity_received=lines_table.c.quantity_received + bindparam("qty")),
+        [{"lid": lines[pid].id, "qty": qty} for pid, qty in ordered],
+    )
+    outstanding = sum(line.quantity_ordered - line.quantity_received for line in lines.values()) - sum(quantities.values())
+    order.status = "received" if outstanding == 0 else "partial"
+
+    stock = dict(db.query(models.Product.id, models.Product.stock).filter(models.Product.id.in_(list(quantities))).all())
+    movement_ids = dict(
+        db.query(models.InventoryMovement.product_id, models.InventoryMovement.id)
+        .filter(models.InventoryMovement.id > last_movement_id, models.InventoryMovement.notes == tag)
+        .all()
+    )
+    result = {
+        "receipt_id": receipt.id,
+        "order_id": order.id,
+        "status": order.status,
+        "lines": [
+            {"movement_id": movement_ids[pid], "product_id": pid, "quantity": qty, "stock": stock[pid]}
+            for pid, qty in quantities.items()
+        ],
+    }
+    db.commit()
+    return result
+
+
+def open_orders(db: Session) -> List[dict]:
+    """Outstanding quantities and value per open order, computed in one aggregate query."""
+    po = models.PurchaseOrder
+    line = models.PurchaseOrderLine
+    outstanding = line.quantity_ordered - line.quantity_received
+    rows = (
+        db.query(
+            po.id, po.supplier_id, models.Supplier.name, po.created_at, po.status,
+            func.count(line.id),
+            func.sum(line.quantity_ordered),
+            func.sum(line.quantity_received),
+            func.sum(outstanding * line.unit_cost),
+        )
+        .join(line, line.order_id == po.id)
+        .outerjoin(models.Supplier, models.Supplier.id == po.supplier_id)
+        .filter(po.status.in_(OPEN_STATUSES))
+        .group_by(po.id, po.supplier_id, models.Supplier.name, po.created_at, po.status)
+        .order_by(po.created_at)
+        .all()
+    )
+    return [
+        {
+            "id": r[0],
+            "supplier_id": r[1],
+            "supplier_name": r[2],
+            "created_at": r[3],
+            "status": r[4],
+            "line_count": r[5],
+            "quantity_ordered": r[6],
+            "quantity_received": r[7],
+            "quantity_outstanding": r[6] - r[7],
+            "value_outstanding": round(r[8] or 0.0, 2),
+        }
+        for r in rows
+    ]
@@ -1,17 +1,37 @@
-from fastapi import APIRouter, Request, Form, HTTPException, Depends
-from fastapi.responses import RedirectResponse
+import asyncio
+import json
+import os
+import tempfile
+from fastapi import APIRouter, Request, Form, HTTPException, Depends, Query, WebSocket, WebSocketDisconnect, UploadFile, File
+from fastapi.responses import RedirectResponse, StreamingResponse, FileResponse
+from starlette.background import BackgroundTask
 from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from database import SessionLocal, init_db
 import models
-from datetime import datetime
-from typing import List
+from datetime import datetime, timezone
+from typing import List, Optional
 from schemas import ProductCreate, Product, SupplierCreate, Supplier, MovementCreate, Movement
+from schemas import BarcodeCreate, Barcode, ScanRequest, ScanResult, CheckoutRequest, CheckoutResult, AuditEntry
+from schemas import BackupRequest, BackupStatus
+from schemas import PurchaseOrderCreate, PurchaseOrder, OpenPurchaseOrder, ReceiptCreate, Receipt
+from checkout import barcode_index, commit_sale, CheckoutError, Ticket
+from stock_events import stock_broker, stock_delta
+from audit import audit_log, AuditReader, snapshot
+import backup
+import purchasing
+from workers import write_lock, watcher, bump_catalog_version, serialized_write
 
 templates = Jinja2Templates(directory="templates")
 router = APIRouter()
 
 
+def _is_alternate_barcode(db: Session, code: str) -> bool:
+    """SKUs and alternate barcodes share one scan namespace."""
+    return db.query(models.ProductBarcode).filter_by(barcode=code).first() is not None
+
+
 def get_db():
     db = SessionLocal()
     try:
@@ -23,6 +43,22 @@ def get_db():
 @router.on_event("startup")
 def startup_event():
     init_db()
+    audit_log.start()
+    db = SessionLocal()
+    barcode_index.load(db)
+    db.close()
+    watcher.start()
+
+
+@router.on_event("startup")
+async def start_stock_broker():
+    stock_broker.attach(asyncio.get_running_loop())
+
+
+@router.on_event("shutdown")
+def shutdown_event():
+    watcher.stop()
+    audit_log.close()
 
 
 @router.get("/products")
@@ -41,15 +77,22 @@ def product_add_form(request: Request):
 
 
 @router.post("/products/add")
+@serialized_write
 def product_add(request: Request, sku: str = Form(...), name: str = Form(...), category: str = Form(""), subcategory: str = Form(""), cost_price: float = Form(0.0), sale_price: float = Form(0.0)):
     db = SessionLocal()
     existing = db.query(models.Product).filter_by(sku=sku).first()
     if existing:
         db.close()
         raise HTTPException(status_code=400, detail="SKU already exists")
+    if _is_alternate_barcode(db, sku):
+        db.close()
+        raise HTTPException(status_code=400, detail="SKU is already used as a barcode")
     p = models.Product(sku=sku, name=name, category=category, subcategory=subcategory, cost_price=cost_price, sale_price=sale_price)
     db.add(p)
+    bump_catalog_version(db)
     db.commit()
+    barcode_index.put_product(p)
+    audit_log.record("product", p.id, "create", after=snapshot(p))
     db.close()
     return RedirectResponse(url="/products", status_code=303)
 
@@ -65,32 +108,53 @@ def product_edit_form(request: Request, product_id: int):
 
 
 @router.post("/products/edit/{product_id}")
+@serialized_write
 def product_edit(request: Request, product_id: int, sku: str = Form(...), name: str = Form(...), category: str = Form(""), subcategory: str = Form(""), cost_price: float = Form(0.0), sale_price: float = Form(0.0)):
     db = SessionLocal()
     p = db.query(models.Product).get(product_id)
     if not p:
         db.close()
         raise HTTPException(status_code=404, detail="Product not found")
+    if sku != p.sku:
+        if db.query(models.Product).filter_by(sku=sku).first():
+            db.close()
+            raise HTTPException(status_code=400, detail="SKU already exists")
+        if _is_alternate_barcode(db, sku):
+            db.close()
+            raise HTTPException(status_code=400, detail="SKU is already used as a barcode")
+    before = snapshot(p)
     p.sku = sku
     p.name = name
     p.category = category
     p.subcategory = subcategory
     p.cost_price = cost_price
     p.sale_price = sale_price
+    after = snapshot(p)
+    bump_catalog_version(db)
     db.commit()
+    barcode_index.put_product(p)
+    audit_log.record("product", product_id, "update", before, after)
     db.close()
     return RedirectResponse(url="/products", status_code=303)
 
 
 @router.post("/products/delete/{product_id}")
+@serialized_write
 def product_delete(product_id: int):
     db = SessionLocal()
     p = db.query(models.Product).get(product_id)
     if not p:
         db.close()
         raise HTTPException(status_code=404, detail="Product not found")
+    if purchasing.has_open_lines(db, product_id):
+        db.close()
+        raise HTTPException(status_code=409, detail="Product is on an open purchase order")
+    before = snapshot(p)
     db.delete(p)
+    bump_catalog_version(db)
     db.commit()
+    barcode_index.remove_product(product_id)
+    audit_log.record("product", product_id, "delete", before=before)
     db.close()
     return RedirectResponse(url="/products", status_code=303)
 
@@ -108,11 +172,13 @@ def supplier_add_form(request: Request):
 
 
 @router.post("/suppliers/add")
+@serialized_write
 def supplier_add(request: Request, name: str = Form(...), contact: str = Form(""), phone: str = Form(""), address: str = Form("")):
     db = SessionLocal()
     s = models.Supplier(name=name, contact=contact, phone=phone, address=address)
     db.add(s)
     db.commit()
+    audit_log.record("supplier", s.id, "create", after=snapshot(s))
     db.close()
     return RedirectResponse(url="/suppliers", status_code=303)
 
@@ -150,9 +216,11 @@ def movement_add_form(request: Request):
 
 
 @router.post("/movements/add")
+@serialized_write
 def movement_add(request: Request, product_id: int = Form(...), type: str = Form(...), quantity: int = Form(...), supplier_id: int = Form(None), notes: str = Form("")):
     db = SessionLocal()
-    p = db.query(models.Product).get(product_id)
+    # Row lock so concurrent movements on PostgreSQL can't lose an update
+    p = db.query(models.Product).with_for_update().filter_by(id=product_id).first()
     if not p:
         db.close()
         raise HTTPException(status_code=404, detail="Product not found")
@@ -174,32 +242,78 @@ def movement_add(request: Request, product_id: int = Form(...), type: str = Form
     mv = models.InventoryMovement(product_id=product_id, type=type, quantity=quantity, supplier_id=supplier_id, notes=notes)
     db.add(mv)
     db.commit()
+    stock_broker.publish([stock_delta(p.id, p.stock, mv.id)])
     db.close()
     return RedirectResponse(url="/movements", status_code=303)
 
 
+# Purchase orders
+@router.get("/purchase-orders")
+def purchase_order_list(request: Request, db: Session = Depends(get_db)):
+    orders = purchasing.open_orders(db)
+    return templates.TemplateResponse("purchase_orders.html", {"request": request, "orders": orders})
+
+
+@router.post("/purchase-orders/{order_id}/receive")
+@serialized_write
+def purchase_order_receive(order_id: int, notes: str = Form("")):
+    db = SessionLocal()
+    try:
+        result = purchasing.receive(db, order_id, notes=notes or None)
+    except purchasing.PurchasingError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    finally:
+        db.close()
+    stock_broker.publish([stock_delta(l["product_id"], l["stock"], l["movement_id"]) for l in result["lines"]])
+    return RedirectResponse(url="/purchase-orders", status_code=303)
+
+
 # JSON API endpoints
 @router.post("/api/products", response_model=Product)
+@serialized_write
 def api_create_product(payload: ProductCreate):
     db = SessionLocal()
     existing = db.query(models.Product).filter_by(sku=payload.sku).first()
     if existing:
         db.close()
         raise HTTPException(status_code=400, detail="SKU exists")
+    if _is_alternate_barcode(db, payload.sku):
+        db.close()
+        raise HTTPException(status_code=400, detail="SKU is already used as a barcode")
     p = models.Product(**payload.dict())
     db.add(p)
+    bump_catalog_version(db)
     db.commit()
     db.refresh(p)
+    barcode_index.put_product(p)
+    audit_log.record("product", p.id, "create", after=snapshot(p))
     db.close()
     return p
 
 
+STREAM_BATCH_SIZE = 500
+
+
+def _stream_list(query, schema):
+    """Stream a JSON array of ``schema`` rows without loading the whole table.
+
+    On PostgreSQL the rows come from a server-side cursor ``STREAM_BATCH_SIZE`` at a time.
+    """
+    def rows(db: Session):
+        try:
+            yield "["
+            for i, obj in enumerate(query(db).execution_options(stream_results=True).yield_per(STREAM_BATCH_SIZE)):
+                yield ("," if i else "") + schema.from_orm(obj).json()
+            yield "]"
+        finally:
+            db.close()
+
+    return StreamingResponse(rows(SessionLocal()), media_type="application/json")
+
+
 @router.get("/api/products", response_model=List[Product])
 def api_list_products():
-    db = SessionLocal()
-    ps = db.query(models.Product).order_by(models.Product.name).all()
-    db.close()
-    return ps
+    return _stream_list(lambda db: db.query(models.Product).order_by(models.Product.name), Product)
 
 
 @router.get("/api/products/{product_id}", response_model=Product)
@@ -213,6 +327,7 @@ def api_get_product(product_id: int):
 
 
 @router.put("/api/products/{product_id}", response_model=Product)
+@serialized_write
 def api_update_product(product_id: int, payload: ProductCreate):
     db = SessionLocal()
     p = db.query(models.Product).get(product_id)
@@ -225,34 +340,52 @@ def api_update_product(product_id: int, payload: ProductCreate):
         if existing:
             db.close()
             raise HTTPException(status_code=400, detail="SKU already exists")
+        if _is_alternate_barcode(db, payload.sku):
+            db.close()
+            raise HTTPException(status_code=400, detail="SKU is already used as a barcode")
+    before = snapshot(p)
     for key, value in payload.dict().items():
         setattr(p, key, value)
+    after = snapshot(p)
+    bump_catalog_version(db)
     db.commit()
     db.refresh(p)
+    barcode_index.put_product(p)
+    audit_log.record("product", product_id, "update", before, after)
     db.close()
     return p
 
 
 @router.delete("/api/products/{product_id}")
+@serialized_write
 def api_delete_product(product_id: int):
     db = SessionLocal()
     p = db.query(models.Product).get(product_id)
     if not p:
         db.close()
         raise HTTPException(status_code=404, detail="Product not found")
+    if purchasing.has_open_lines(db, product_id):
+        db.close()
+        raise HTTPException(status_code=409, detail="Product is on an open purchase order")
+    before = snapshot(p)
     db.delete(p)
+    bump_catalog_version(db)
     db.commit()
+    barcode_index.remove_product(product_id)
+    audit_log.record("product", product_id, "delete", before=before)
     db.close()
     return {"message": "Product deleted successfully"}
 
 
 @router.post("/api/suppliers", response_model=Supplier)
+@serialized_write
 def api_create_supplier(payload: SupplierCreate):
     db = SessionLocal()
     s = models.Supplier(**payload.dict())
     db.add(s)
     db.commit()
     db.refresh(s)
+    audit_log.record("supplier", s.id, "create", after=snapshot(s))
     db.close()
     return s
 
@@ -276,37 +409,46 @@ def api_get_supplier(supplier_id: int):
 
 
 @router.put("/api/suppliers/{supplier_id}", response_model=Supplier)
+@serialized_write
 def api_update_supplier(supplier_id: int, payload: SupplierCreate):
     db = SessionLocal()
     s = db.query(models.Supplier).get(supplier_id)
     if not s:
         db.close()
         raise HTTPException(status_code=404, detail="Supplier not found")
+    before = snapshot(s)
     for key, value in payload.dict().items():
         setattr(s, key, value)
+    after = snapshot(s)
     db.commit()
     db.refresh(s)
+    audit_log.record("supplier", supplier_id, "update", before, after)
     db.close()
     return s
 
 
 @router.delete("/api/suppliers/{supplier_id}")
+@serialized_write
 def api_delete_supplier(supplier_id: int):
     db = SessionLocal()
     s = db.query(models.Supplier).get(supplier_id)
     if not s:
         db.close()
         raise HTTPException(status_code=404, detail="Supplier not found")
+    before = snapshot(s)
     db.delete(s)
     db.commit()
+    audit_log.record("supplier", supplier_id, "delete", before=before)
     db.close()
     return {"message": "Supplier deleted successfully"}
 
 
 @router.post("/api/movements", response_model=Movement)
+@serialized_write
 def api_create_movement(payload: MovementCreate):
     db = SessionLocal()
-    p = db.query(models.Product).get(payload.product_id)
+    # Row lock so concurrent movements on PostgreSQL can't lose an update
+    p = db.query(models.Product).with_for_update().filter_by(id=payload.product_id).first()
     if not p:
         db.close()
         raise HTTPException(status_code=404, detail="Product not found")
@@ -326,16 +468,16 @@ def api_create_movement(payload: MovementCreate):
     db.add(mv)
     db.commit()
     db.refresh(mv)
+    stock_broker.publish([stock_delta(p.id, p.stock, mv.id)])
     db.close()
     return mv
 
 
 @router.get("/api/movements", response_model=List[Movement])
 def api_list_movements():
-    db = SessionLocal()
-    movements = db.query(models.InventoryMovement).order_by(models.InventoryMovement.date.desc()).all()
-    db.close()
-    return movements
+    return _stream_list(
+        lambda db: db.query(models.InventoryMovement).order_by(models.InventoryMovement.date.desc()), Movement
+    )
 
 
 @router.get("/api/movements/{movement_id}", response_model=Movement)
@@ -347,3 +489,364 @@ def api_get_movement(movement_id: int):
         raise HTTPException(status_code=404, detail="Movement not found")
     return mv
 
+
+
+
+def _parse_time(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid date: {value}")
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+@router.get("/api/audit", response_model=List[AuditEntry])
+def api_list_audit(entity: Optional[str] = None, entity_id: Optional[int] = None, since: Optional[str] = None, until: Optional[str] = None):
+    # Make sure changes queued by earlier requests are visible to the reader.
+    audit_log.flush(timeout=5)
+    entries = AuditReader(audit_log.directory).query(entity, entity_id, _parse_time(since), _parse_time(until))
+    for e in entries:
+        e["timestamp"] = datetime.utcfromtimestamp(e["timestamp"])
+    return entries
+
+
+# Barcodes and checkout
+@router.get("/api/products/{product_id}/barcodes", response_model=List[Barcode])
+def api_list_barcodes(product_id: int):
+    db = SessionLocal()
+    p = db.query(models.Product).get(product_id)
+    if not p:
+        db.close()
+        raise HTTPException(status_code=404, detail="Product not found")
+    barcodes = list(p.barcodes)
+    db.close()
+    return barcodes
+
+
+@router.post("/api/products/{product_id}/barcodes", response_model=Barcode)
+@serialized_write
+def api_add_barcode(product_id: int, payload: BarcodeCreate):
+    db = SessionLocal()
+    p = db.query(models.Product).get(product_id)
+    if not p:
+        db.close()
+        raise HTTPException(status_code=404, detail="Product not found")
+    # The index can lag a SKU created on another worker by one poll; ask the database too.
+    if (
+        barcode_index.lookup(payload.barcode)
+        or db.query(models.ProductBarcode).filter_by(barcode=payload.barcode).first()
+        or db.query(models.Product).filter_by(sku=payload.barcode).first()
+    ):
+        db.close()
+        raise HTTPException(status_code=400, detail="Barcode already exists")
+    b = models.ProductBarcode(product_id=product_id, barcode=payload.barcode)
+    db.add(b)
+    bump_catalog_version(db)
+    db.commit()
+    db.refresh(b)
+    barcode_index.add_barcode(product_id, b.barcode)
+    audit_log.record("barcode", b.id, "create", after=snapshot(b))
+    db.close()
+    return b
+
+
+@router.delete("/api/barcodes/{barcode}")
+@serialized_write
+def api_delete_barcode(barcode: str):
+    db = SessionLocal()
+    b = db.query(models.ProductBarcode).filter_by(barcode=barcode).first()
+    if not b:
+        db.close()
+        raise HTTPException(status_code=404, detail="Barcode not found")
+    before = snapshot(b)
+    db.delete(b)
+    bump_catalog_version(db)
+    db.commit()
+    barcode_index.remove_barcode(barcode)
+    audit_log.record("barcode", before["id"], "delete", before=before)
+    db.close()
+    return {"message": "Barcode deleted successfully"}
+
+
+@router.post("/api/scan", response_model=ScanResult)
+async def api_scan(payload: ScanRequest):
+    # Served from the in-memory index only; no database round trip per scan.
+    entry = barcode_index.lookup(payload.code)
+    if not entry:
+        raise HTTPException(status_code=404, detail="Unknown barcode")
+    return entry._asdict()
+
+
+@router.post("/api/checkout", response_model=CheckoutResult)
+@serialized_write
+def api_checkout(payload: CheckoutRequest):
+    ticket = Ticket()
+    for line in payload.lines:
+        entry = barcode_index.lookup(line.code)
+        if not entry:
+            raise HTTPException(status_code=404, detail=f"Unknown barcode {line.code}")
+        ticket.add(entry, line.quantity)
+    db = SessionLocal()
+    try:
+        movements = commit_sale(db, ticket.quantities(), ticket.id)
+    except CheckoutError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    finally:
+        db.close()
+    stock_broker.publish([stock_delta(m["product_id"], m["stock"], m["movement_id"]) for m in movements])
+    return {"ticket_id": ticket.id, "movements": movements}
+
+
+def _commit_ticket(ticket: Ticket):
+    db = SessionLocal()
+    try:
+        with write_lock.hold_sync():
+            movements = commit_sale(db, ticket.quantities(), ticket.id)
+            # Publish before releasing, so deltas reach the broker in commit order
+            stock_broker.publish([stock_delta(m["product_id"], m["stock"], m["movement_id"]) for m in movements])
+    finally:
+        db.close()
+    return movements
+
+
+@router.websocket("/ws/checkout")
+async def ws_checkout(websocket: WebSocket):
+    """Register session: scans accumulate on an open ticket until it is committed.
+
+    Messages are JSON objects with an ``action`` of ``scan`` (``code``, optional
+    ``quantity``; negative quantities void items), ``commit`` or ``cancel``.
+    """
+    await websocket.accept()
+    ticket = Ticket()
+    try:
+        while True:
+            try:
+                msg = await websocket.receive_json()
+            except ValueError:
+                await websocket.send_json({"event": "error", "detail": "Invalid JSON"})
+                continue
+            if not isinstance(msg, dict):
+                await websocket.send_json({"event": "error", "detail": "Message must be a JSON object"})
+                continue
+            action = msg.get("action")
+            if action == "scan":
+                quantity = msg.get("quantity", 1)
+                if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity == 0:
+                    await websocket.send_json({"event": "error", "detail": "Quantity must be a non-zero integer"})
+                    continue
+                code = msg.get("code")
+                if not isinstance(code, str) or not code:
+                    await websocket.send_json({"event": "error", "detail": "Missing barcode"})
+                    continue
+                entry = barcode_index.lookup(code)
+                if not entry:
+                    await websocket.send_json({"event": "error", "detail": "Unknown barcode", "code": msg.get("code")})
+                    continue
+                ticket.add(entry, quantity)
+                await websocket.send_json({"event": "scanned", "product": entry._asdict(), "ticket": ticket.summary()})
+            elif action == "commit":
+                try:
+                    movements = await run_in_threadpool(_commit_ticket, ticket)
+                except CheckoutError as e:
+                    await websocket.send_json({"event": "error", "detail": e.detail, "ticket": ticket.summary()})
+                    continue
+                await websocket.send_json({"event": "committed", "ticket_id": ticket.id, "movements": movements})
+                ticket = Ticket()
+            elif action == "cancel":
+                ticket = Ticket()
+                await websocket.send_json({"event": "cancelled", "ticket": ticket.summary()})
+            else:
+                await websocket.send_json({"event": "error", "detail": "Unknown action"})
+    except WebSocketDisconnect:
+        pass
+
+
+# Live stock updates
+SSE_KEEPALIVE_SECONDS = 15
+
+
+@router.get("/api/stock/stream")
+async def api_stock_stream(request: Request, product_id: Optional[List[int]] = Query(None)):
+    """Server-sent events with stock deltas, optionally limited to some products."""
+    sub = stock_broker.subscribe(product_id)
+
+    async def events():
+        try:
+            yield ": connected\n\n"
+            while True:
+                try:
+                    deltas, resync = await asyncio.wait_for(sub.get(), SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": ping\n\n"
+                    continue
+                if resync:
+                    yield "event: resync\ndata: {}\n\n"
+                if deltas:
+                    yield f"event: stock\ndata: {json.dumps(deltas, separators=(',', ':'))}\n\n"
+        finally:
+            stock_broker.unsubscribe(sub)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@router.websocket("/ws/stock")
+async def ws_stock(websocket: WebSocket, product_id: Optional[List[int]] = Query(None)):
+    await websocket.accept()
+    sub = stock_broker.subscribe(product_id)
+    receiver = asyncio.ensure_future(websocket.receive())
+    getter = None
+    try:
+        while True:
+            getter = asyncio.ensure_future(sub.get())
+            done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver in done:
+                if receiver.result()["type"] == "websocket.disconnect":
+                    break
+                # Clients have nothing to say on this channel; ignore and keep listening.
+                receiver = asyncio.ensure_future(websocket.receive())
+            if getter in done:
+                deltas, resync = getter.result()
+                if resync:
+                    await websocket.send_json({"event": "resync"})
+                if deltas:
+                    await websocket.send_json({"event": "stock", "deltas": deltas})
+            else:
+                getter.cancel()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        stock_broker.unsubscribe(sub)
+        receiver.cancel()
+        if getter:
+            getter.cancel()
+
+
+# Backups and snapshots
+@router.post("/api/backups", response_model=BackupStatus)
+def api_start_backup(payload: BackupRequest = BackupRequest()):
+    if payload.pages == 0 or payload.sleep < 0:
+        raise HTTPException(status_code=400, detail="Invalid backup parameters")
+    try:
+        job = backup.start_backup(payload.pages, payload.sleep)
+    except backup.BackupError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return job.to_dict()
+
+
+@router.get("/api/backups", response_model=List[BackupStatus])
+def api_list_backups():
+    return backup.list_jobs()
+
+
+@router.get("/api/backups/{job_id}", response_model=BackupStatus)
+def api_get_backup(job_id: str):
+    job = backup.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Backup not found")
+    return job
+
+
+@router.get("/api/snapshot")
+def api_export_snapshot():
+    fd, path = tempfile.mkstemp(suffix=".db.gz")
+    os.close(fd)
+    try:
+        backup.export_snapshot(path)
+    except backup.BackupError as e:
+        os.remove(path)
+        raise HTTPException(status_code=400, detail=str(e))
+    filename = f"inventory-{datetime.utcnow():%Y%m%d-%H%M%S}.db.gz"
+    return FileResponse(path, media_type="application/gzip", filename=filename, background=BackgroundTask(os.remove, path))
+
+
+@router.post("/api/snapshot/restore", response_model=BackupStatus)
+@serialized_write
+def api_restore_snapshot(file: UploadFile = File(...)):
+    fd, path = tempfile.mkstemp(suffix=".db.gz")
+    with os.fdopen(fd, "wb") as out:
+        while True:
+            chunk = file.file.read(1024 * 1024)
+            if not chunk:
+                break
+            out.write(chunk)
+    try:
+        job = backup.restore_snapshot(path)
+    except backup.BackupError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        os.remove(path)
+    # Other workers notice the restore through its sync_state version.
+    db = SessionLocal()
+    barcode_index.load(db)
+    db.close()
+    stock_broker.resync()
+    return job.to_dict()
+
+
+@router.post("/api/purchase-orders", response_model=PurchaseOrder)
+@serialized_write
+def api_create_purchase_order(payload: PurchaseOrderCreate):
+    db = SessionLocal()
+    try:
+        order = purchasing.create_order(db, payload.supplier_id, [line.dict() for line in payload.lines], payload.notes)
+        return PurchaseOrder.from_orm(order)
+    except purchasing.PurchasingError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    finally:
+        db.close()
+
+
+@router.get("/api/purchase-orders", response_model=List[PurchaseOrder])
+def api_list_purchase_orders(status: Optional[str] = None):
+    db = SessionLocal()
+    query = db.query(models.PurchaseOrder)
+    if status:
+        query = query.filter(models.PurchaseOrder.status == status)
+    orders = [PurchaseOrder.from_orm(o) for o in query.order_by(models.PurchaseOrder.created_at.desc()).all()]
+    db.close()
+    return orders
+
+
+@router.get("/api/purchase-orders/open", response_model=List[OpenPurchaseOrder])
+def api_open_purchase_orders():
+    db = SessionLocal()
+    orders = purchasing.open_orders(db)
+    db.close()
+    return orders
+
+
+@router.get("/api/purchase-orders/{order_id}", response_model=PurchaseOrder)
+def api_get_purchase_order(order_id: int):
+    db = SessionLocal()
+    order = db.query(models.PurchaseOrder).get(order_id)
+    if not order:
+        db.close()
+        raise HTTPException(status_code=404, detail="Purchase order not found")
+    result = PurchaseOrder.from_orm(order)
+    db.close()
+    return result
+
+
+@router.post("/api/purchase-orders/{order_id}/receipts", response_model=Receipt)
+@serialized_write
+def api_receive_purchase_order(order_id: int, payload: ReceiptCreate = ReceiptCreate()):
+    quantities = None
+    if payload.lines is not None:
+        quantities = {}
+        for line in payload.lines:
+            quantities[line.product_id] = quantities.get(line.product_id, 0) + line.quantity
+    db = SessionLocal()
+    try:
+        result = purchasing.receive(db, order_id, quantities, payload.notes)
+    except purchasing.PurchasingError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    finally:
+        db.close()
+    stock_broker.publish([stock_delta(l["product_id"], l["stock"], l["movement_id"]) for l in result["lines"]])
+    return result
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, conint, constr
+from typing import List, Optional
 from datetime import datetime
 
 
@@ -60,3 +60,153 @@ class Movement(MovementBase):
 
     class Config:
         orm_mode = True
+
+
+class BarcodeCreate(BaseModel):
+    barcode: constr(min_length=1)
+
+
+class Barcode(BarcodeCreate):
+    id: int
+    product_id: int
+
+    class Config:
+        orm_mode = True
+
+
+class ScanRequest(BaseModel):
+    code: constr(min_length=1)
+
+
+class ScanResult(BaseModel):
+    product_id: int
+    sku: str
+    name: str
+    sale_price: float
+
+
+class CheckoutLine(BaseModel):
+    code: str
+    # Voids are only possible in a WebSocket session, before the ticket is committed
+    quantity: conint(gt=0) = 1
+
+
+class CheckoutRequest(BaseModel):
+    lines: List[CheckoutLine]
+
+
+class CheckoutMovement(BaseModel):
+    movement_id: int
+    product_id: int
+    quantity: int
+    stock: int
+
+
+class CheckoutResult(BaseModel):
+    ticket_id: str
+    movements: List[CheckoutMovement]
+
+
+class AuditEntry(BaseModel):
+    timestamp: datetime
+    entity: str
+    entity_id: int
+    action: str
+    changes: dict
+
+
+class BackupRequest(BaseModel):
+    pages: int = 256
+    sleep: float = 0.005
+
+
+class BackupStep(BaseModel):
+    remaining: int
+    total: int
+    seconds: float
+
+
+class BackupStatus(BaseModel):
+    id: str
+    target: str
+    status: str
+    error: Optional[str] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    pages_total: int
+    pages_remaining: int
+    restarts: int
+    steps: List[BackupStep]
+
+
+class PurchaseOrderLineCreate(BaseModel):
+    product_id: int
+    quantity: int
+    unit_cost: Optional[float] = 0.0
+
+
+class PurchaseOrderCreate(BaseModel):
+    supplier_id: int
+    notes: Optional[str] = None
+    lines: List[PurchaseOrderLineCreate]
+
+
+class PurchaseOrderLine(BaseModel):
+    id: int
+    product_id: int
+    quantity_ordered: int
+    quantity_received: int
+    unit_cost: float
+
+    class Config:
+        orm_mode = True
+
+
+class PurchaseOrder(BaseModel):
+    id: int
+    supplier_id: int
+    status: str
+    created_at: datetime
+    notes: Optional[str] = None
+    lines: List[PurchaseOrderLine]
+
+    class Config:
+        orm_mode = True
+
+
+class OpenPurchaseOrder(BaseModel):
+    id: int
+    supplier_id: int
+    supplier_name: Optional[str] = None
+    created_at: datetime
+    status: str
+    line_count: int
+    quantity_ordered: int
+    quantity_received: int
+    quantity_outstanding: int
+    value_outstanding: float
+
+
+class ReceiptLineCreate(BaseModel):
+    product_id: int
+    quantity: int
+
+
+class ReceiptCreate(BaseModel):
+    # Leave out lines to receive everything still outstanding
+    lines: Optional[List[ReceiptLineCreate]] = None
+    notes: Optional[str] = None
+
+
+class ReceiptLine(BaseModel):
+    movement_id: int
+    product_id: int
+    quantity: int
+    stock: int
+
+
+class Receipt(BaseModel):
+    receipt_id: int
+    order_id: int
+    status: str
+    lines: List[ReceiptLine]
@@ -0,0 +1,35 @@
+"""
+Run the app with several worker processes sharing one SQLite database.
+
+    python serve.py --workers 4 --host 0.0.0.0 --port 8000
+
+Every worker serves reads; writes are serialized across workers (see
+workers.py) and each worker watches the database for commits made by the
+others to keep its caches and live stock streams current.
+"""
+import argparse
+import os
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the inventory app with multiple workers")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args(argv)
+
+    # Workers read this at import time; with more than one, their watchers also
+    # forward movements committed by the others to live stock streams.
+    os.environ["INVENTORY_WORKERS"] = str(args.workers)
+
+    # Create the schema once here rather than racing in every worker.
+    from database import init_db
+    init_db()
+
+    import uvicorn
+    uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers, log_level=args.log_level)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+In-process pub/sub for stock changes.
+
+Routes call ``stock_broker.publish`` after a movement is committed; WebSocket and
+SSE clients hold a ``Subscription`` that coalesces bursts so a slow screen only
+ever receives the latest stock per product.
+"""
+import asyncio
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+def stock_delta(product_id: int, stock: int, movement_id: int) -> dict:
+    return {"product_id": product_id, "stock": stock, "movement_id": movement_id}
+
+
+class Subscription:
+    """Pending deltas for one client, keyed by product so bursts collapse.
+
+    At most ``max_pending`` distinct products are buffered. A client that falls
+    further behind is asked to resync (re-read ``/api/products``) instead of
+    growing the buffer without bound.
+    """
+
+    def __init__(self, product_ids: Optional[Iterable[int]] = None, max_pending: int = 1024):
+        self.product_ids = set(product_ids) if product_ids else None
+        self.max_pending = max_pending
+        self._pending: "OrderedDict[int, dict]" = OrderedDict()
+        # Latest movement id already handed to the client, per product
+        self._sent: Dict[int, int] = {}
+        self._resync = False
+        self._ready = asyncio.Event()
+
+    def offer(self, delta: dict):
+        product_id = delta["product_id"]
+        if self.product_ids is not None and product_id not in self.product_ids:
+            return
+        # Publishers race to the loop, so a delta can arrive after a newer one for
+        # the same product, even after that one was sent; only newer ones count.
+        pending = self._pending.get(product_id)
+        latest = pending["movement_id"] if pending is not None else self._sent.get(product_id, 0)
+        if delta["movement_id"] <= latest:
+            return
+        if pending is not None or len(self._pending) < self.max_pending:
+            self._pending[product_id] = delta
+        else:
+            self.request_resync()
+            return
+        self._ready.set()
+
+    def request_resync(self, forget_movements: bool = False):
+        """Drop pending deltas and tell the client to re-read all stock.
+
+        ``forget_movements`` is for restores, after which movement ids may go back.
+        """
+        self._pending.clear()
+        if forget_movements:
+            self._sent.clear()
+        self._resync = True
+        self._ready.set()
+
+    async def get(self) -> Tuple[List[dict], bool]:
+        """Wait for changes and return ``(deltas, resync)``, draining the buffer."""
+        await self._ready.wait()
+        self._ready.clear()
+        deltas = list(self._pending.values())
+        resync = self._resync
+        for delta in deltas:
+            self._sent[delta["product_id"]] = delta["movement_id"]
+        self._pending.clear()
+        self._resync = False
+        return deltas, resync
+
+
+class StockBroker:
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._subscriptions = set()
+        # Set when a database watcher feeds the broker (multi-worker mode); then
+        # deltas published directly by the commit paths are ignored.
+        self.external_feed = False
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+
+    def subscribe(self, product_ids: Optional[Iterable[int]] = None) -> Subscription:
+        sub = Subscription(product_ids)
+        self._subscriptions.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        self._subscriptions.discard(sub)
+
+    def publish(self, deltas: List[dict], external: bool = False):
+        """Queue deltas for every subscriber. Safe to call from worker threads."""
+        if not self._subscriptions or self._loop is None or not deltas:
+            return
+        if self.external_feed and not external:
+            return
+        self._loop.call_soon_threadsafe(self._dispatch, deltas)
+
+    def resync(self):
+        """Ask every subscriber to re-read stock, e.g. after a restore. Thread safe."""
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._dispatch_resync)
+
+    def _dispatch_resync(self):
+        for sub in list(self._subscriptions):
+            sub.request_resync(forget_movements=True)
+
+    def _dispatch(self, deltas: List[dict]):
+        for sub in list(self._subscriptions):
+            for delta in deltas:
+                sub.offer(delta)
+
+
+stock_broker = StockBroker()
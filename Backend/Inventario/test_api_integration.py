@@ -8,6 +8,15 @@ import time
 import requests
 import os
 import signal
+import socket
+import json
+import gzip
+import shutil
+import tempfile
+import threading
+import sqlite3
+
+from sqlalchemy import create_engine, text
 
 
 @pytest.fixture(scope="module")
@@ -20,6 +29,10 @@ def server():
     
     # Set test database
     os.environ["DATABASE_URL"] = f"sqlite:///./{test_db}"
+    audit_dir = tempfile.mkdtemp(prefix="audit-")
+    os.environ["AUDIT_DIR"] = audit_dir
+    backup_dir = tempfile.mkdtemp(prefix="backups-")
+    os.environ["BACKUP_DIR"] = backup_dir
     
     # Start server
     process = subprocess.Popen(
@@ -47,8 +60,11 @@ def server():
     # Cleanup
     process.send_signal(signal.SIGTERM)
     process.wait(timeout=5)
-    if os.path.exists(test_db):
-        os.remove(test_db)
+    for suffix in ("", "-wal", "-shm", ".writelock"):
+        if os.path.exists(test_db + suffix):
+            os.remove(test_db + suffix)
+    shutil.rmtree(audit_dir, ignore_errors=True)
+    shutil.rmtree(backup_dir, ignore_errors=True)
 
 
 class TestProductsAPI:
@@ -304,6 +320,559 @@ class TestMovementsAPI:
         assert data["id"] == movement_id
 
 
+class TestCheckoutAPI:
+    """Test barcode lookup and checkout endpoints"""
+
+    def _product_with_stock(self, server, sku, stock, sale_price=10.0):
+        product_id = requests.post(
+            f"{server}/api/products",
+            json={"sku": sku, "name": f"Checkout {sku}", "sale_price": sale_price}
+        ).json()["id"]
+        requests.post(
+            f"{server}/api/movements",
+            json={"product_id": product_id, "type": "entry", "quantity": stock}
+        )
+        return product_id
+
+    def test_scan_by_sku_and_alternate_barcode(self, server):
+        """Test resolving a product by SKU and by an alternate barcode"""
+        product_id = self._product_with_stock(server, "SCAN001", 5)
+        response = requests.post(
+            f"{server}/api/products/{product_id}/barcodes",
+            json={"barcode": "7501000000011"}
+        )
+        assert response.status_code == 200
+
+        for code in ("SCAN001", "7501000000011"):
+            response = requests.post(f"{server}/api/scan", json={"code": code})
+            assert response.status_code == 200
+            assert response.json()["product_id"] == product_id
+
+        # Duplicate barcodes are rejected
+        response = requests.post(
+            f"{server}/api/products/{product_id}/barcodes",
+            json={"barcode": "7501000000011"}
+        )
+        assert response.status_code == 400
+
+        response = requests.post(f"{server}/api/scan", json={"code": "NOPE"})
+        assert response.status_code == 404
+
+    def test_scan_follows_sku_change(self, server):
+        """Test that editing a product's SKU updates the scan index"""
+        product_id = self._product_with_stock(server, "SCAN002", 1)
+        requests.put(
+            f"{server}/api/products/{product_id}",
+            json={"sku": "SCAN002B", "name": "Renamed"}
+        )
+        assert requests.post(f"{server}/api/scan", json={"code": "SCAN002"}).status_code == 404
+        response = requests.post(f"{server}/api/scan", json={"code": "SCAN002B"})
+        assert response.json()["name"] == "Renamed"
+
+    def test_checkout_commits_ticket(self, server):
+        """Test that a ticket is committed as sale movements"""
+        first = self._product_with_stock(server, "CHK001", 10)
+        second = self._product_with_stock(server, "CHK002", 10)
+        response = requests.post(
+            f"{server}/api/checkout",
+            json={"lines": [
+                {"code": "CHK001", "quantity": 2},
+                {"code": "CHK002"},
+                {"code": "CHK001"}
+            ]}
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data["movements"]) == 2
+        assert requests.get(f"{server}/api/products/{first}").json()["stock"] == 7
+        assert requests.get(f"{server}/api/products/{second}").json()["stock"] == 9
+
+    def test_checkout_is_all_or_nothing(self, server):
+        """Test that one short line rejects the whole ticket"""
+        first = self._product_with_stock(server, "CHK003", 10)
+        self._product_with_stock(server, "CHK004", 1)
+        response = requests.post(
+            f"{server}/api/checkout",
+            json={"lines": [{"code": "CHK003"}, {"code": "CHK004", "quantity": 5}]}
+        )
+        assert response.status_code == 400
+        assert requests.get(f"{server}/api/products/{first}").json()["stock"] == 10
+
+    def test_websocket_checkout_session(self, server):
+        """Test scanning and committing a ticket over the WebSocket session"""
+        from websockets.sync.client import connect
+
+        product_id = self._product_with_stock(server, "WSCHK001", 5, sale_price=12.5)
+        with connect(server.replace("http", "ws") + "/ws/checkout") as ws:
+            ws.send(json.dumps({"action": "scan", "code": "WSCHK001"}))
+            ws.send(json.dumps({"action": "scan", "code": "WSCHK001", "quantity": 2}))
+            json.loads(ws.recv())
+            scanned = json.loads(ws.recv())
+            assert scanned["ticket"]["total"] == 37.5
+            ws.send(json.dumps({"action": "commit"}))
+            committed = json.loads(ws.recv())
+            assert committed["event"] == "committed"
+            assert committed["movements"][0]["stock"] == 2
+        assert requests.get(f"{server}/api/products/{product_id}").json()["stock"] == 2
+
+    def test_websocket_rejects_malformed_messages(self, server):
+        """Test that bad messages get an error event and keep the session open"""
+        from websockets.sync.client import connect
+
+        self._product_with_stock(server, "WSCHK002", 5)
+        with connect(server.replace("http", "ws") + "/ws/checkout") as ws:
+            for message in ('{"action": "scan", "code": "WSCHK002", "quantity": "abc"}', '{"action": "scan"}', '[1, 2]', 'not json'):
+                ws.send(message)
+                assert json.loads(ws.recv())["event"] == "error"
+            ws.send(json.dumps({"action": "scan", "code": "WSCHK002"}))
+            assert json.loads(ws.recv())["event"] == "scanned"
+
+    def test_checkout_rejects_non_positive_quantities(self, server):
+        """Test that checkout lines can't void items"""
+        self._product_with_stock(server, "CHK005", 5)
+        for quantity in (0, -1):
+            response = requests.post(
+                f"{server}/api/checkout",
+                json={"lines": [{"code": "CHK005", "quantity": quantity}]}
+            )
+            assert response.status_code == 422
+
+    def test_sku_cannot_reuse_an_alternate_barcode(self, server):
+        """Test that a SKU can't take over another product's barcode"""
+        product_id = self._product_with_stock(server, "SCAN003", 1)
+        requests.post(f"{server}/api/products/{product_id}/barcodes", json={"barcode": "7501000000028"})
+        response = requests.post(f"{server}/api/products", json={"sku": "7501000000028", "name": "Clash"})
+        assert response.status_code == 400
+        other = self._product_with_stock(server, "SCAN004", 1)
+        response = requests.put(f"{server}/api/products/{other}", json={"sku": "7501000000028", "name": "Clash"})
+        assert response.status_code == 400
+        assert requests.post(f"{server}/api/scan", json={"code": "7501000000028"}).json()["product_id"] == product_id
+        # Nor the other way round, and codes can't be empty
+        response = requests.post(f"{server}/api/products/{other}/barcodes", json={"barcode": "SCAN003"})
+        assert response.status_code == 400
+        response = requests.post(f"{server}/api/products/{other}/barcodes", json={"barcode": ""})
+        assert response.status_code == 422
+        assert requests.post(f"{server}/api/scan", json={"code": ""}).status_code == 422
+
+
+class TestStockStreaming:
+    """Test live stock updates over SSE and WebSockets"""
+
+    def test_coalescing_keeps_latest_movement(self):
+        """Test that a delta arriving out of order doesn't replace a newer one"""
+        import asyncio
+        from stock_events import Subscription, stock_delta
+
+        async def drain():
+            sub = Subscription()
+            sub.offer(stock_delta(1, 8, movement_id=12))
+            sub.offer(stock_delta(1, 9, movement_id=11))
+            return await sub.get()
+
+        deltas, resync = asyncio.run(drain())
+        assert deltas == [stock_delta(1, 8, movement_id=12)]
+        assert not resync
+
+    def test_stale_delta_after_drain_is_dropped(self):
+        """Test that a delta older than one already sent never reaches the client"""
+        import asyncio
+        from stock_events import Subscription, stock_delta
+
+        async def drain_twice():
+            sub = Subscription()
+            sub.offer(stock_delta(1, 3, movement_id=11))
+            first = await sub.get()
+            sub.offer(stock_delta(1, 5, movement_id=10))
+            sub.offer(stock_delta(2, 7, movement_id=9))
+            second = await sub.get()
+            return first, second
+
+        first, second = asyncio.run(drain_twice())
+        assert first[0] == [stock_delta(1, 3, movement_id=11)]
+        assert second[0] == [stock_delta(2, 7, movement_id=9)]
+
+    def test_sse_stream_receives_delta(self, server):
+        """Test that a committed movement is pushed to SSE subscribers"""
+        product_id = requests.post(
+            f"{server}/api/products",
+            json={"sku": "STREAM001", "name": "Streamed Product"}
+        ).json()["id"]
+        with requests.get(
+            f"{server}/api/stock/stream",
+            params={"product_id": product_id},
+            stream=True,
+            timeout=5
+        ) as stream:
+            lines = stream.iter_lines(decode_unicode=True)
+            assert next(lines) == ": connected"
+            movement = requests.post(
+                f"{server}/api/movements",
+                json={"product_id": product_id, "type": "entry", "quantity": 7}
+            ).json()
+            data = None
+            for line in lines:
+                if line.startswith("data: "):
+                    data = json.loads(line[len("data: "):])
+                    break
+        assert data == [{"product_id": product_id, "stock": 7, "movement_id": movement["id"]}]
+
+    def test_websocket_stream_receives_delta(self, server):
+        """Test that WebSocket subscribers only get the products they asked for"""
+        from websockets.sync.client import connect
+
+        watched = requests.post(
+            f"{server}/api/products",
+            json={"sku": "STREAM002", "name": "Watched"}
+        ).json()["id"]
+        other = requests.post(
+            f"{server}/api/products",
+            json={"sku": "STREAM003", "name": "Not Watched"}
+        ).json()["id"]
+        url = server.replace("http", "ws") + f"/ws/stock?product_id={watched}"
+        with connect(url) as ws:
+            time.sleep(0.2)
+            requests.post(
+                f"{server}/api/movements",
+                json={"product_id": other, "type": "entry", "quantity": 1}
+            )
+            requests.post(
+                f"{server}/api/movements",
+                json={"product_id": watched, "type": "entry", "quantity": 3}
+            )
+            message = json.loads(ws.recv(timeout=5))
+        assert message["event"] == "stock"
+        assert [d["product_id"] for d in message["deltas"]] == [watched]
+        assert message["deltas"][0]["stock"] == 3
+
+
+class TestAuditAPI:
+    """Test the audit trail of product and supplier changes"""
+
+    def test_product_changes_are_audited(self, server):
+        """Test that create, update and delete record before/after diffs"""
+        product_id = requests.post(
+            f"{server}/api/products",
+            json={"sku": "AUDIT001", "name": "Audited", "sale_price": 5.0}
+        ).json()["id"]
+        requests.put(
+            f"{server}/api/products/{product_id}",
+            json={"sku": "AUDIT001", "name": "Audited", "sale_price": 6.0}
+        )
+        requests.delete(f"{server}/api/products/{product_id}")
+
+        response = requests.get(
+            f"{server}/api/audit",
+            params={"entity": "product", "entity_id": product_id}
+        )
+        assert response.status_code == 200
+        entries = response.json()
+        assert [e["action"] for e in entries] == ["create", "update", "delete"]
+        assert entries[1]["changes"] == {"sale_price": [5.0, 6.0]}
+        assert entries[2]["changes"]["sku"] == ["AUDIT001", None]
+
+    def test_supplier_update_is_audited(self, server):
+        """Test that supplier edits can be filtered by time range"""
+        supplier_id = requests.post(
+            f"{server}/api/suppliers",
+            json={"name": "Audited Supplier"}
+        ).json()["id"]
+        requests.put(
+            f"{server}/api/suppliers/{supplier_id}",
+            json={"name": "Audited Supplier", "phone": "555"}
+        )
+        entries = requests.get(
+            f"{server}/api/audit",
+            params={"entity": "supplier", "entity_id": supplier_id}
+        ).json()
+        assert entries[-1]["changes"] == {"phone": [None, "555"]}
+
+        later = requests.get(
+            f"{server}/api/audit",
+            params={"entity": "supplier", "since": "2999-01-01T00:00:00"}
+        ).json()
+        assert later == []
+
+    def test_non_ascii_entity_matches_nothing(self, server):
+        """Test that an entity filter outside the stored names isn't an error"""
+        response = requests.get(f"{server}/api/audit", params={"entity": "ñ"})
+        assert response.status_code == 200
+        assert response.json() == []
+
+    def test_damaged_records_and_write_errors(self):
+        """Test that a corrupt record is skipped and a failed write doesn't stop the writer"""
+        from audit import AuditLog, AuditReader, pack_record
+
+        directory = tempfile.mkdtemp(prefix="audit-unit-")
+        log = AuditLog(directory)
+        try:
+            log.start()
+            log.record("product", 1, "create", after={"name": "a"})
+            log.flush(timeout=5)
+            with open(log._segment_path(), "ab") as f:
+                f.write(pack_record(time.time(), "product", 1, "update", {})[:-2] + b"{x")
+            log.record("product", 1, "update", {"name": "a"}, {"name": "b"})
+            log.flush(timeout=5)
+            assert [e["action"] for e in AuditReader(directory).query("product", 1)] == ["create", "update"]
+
+            os.close(log._fd)  # make the next write fail
+            log.record("product", 2, "create", after={"name": "lost"})
+            start = time.time()
+            log.flush(timeout=5)
+            assert time.time() - start < 1
+            log.record("product", 3, "create", after={"name": "c"})
+            log.flush(timeout=5)
+            assert [e["entity_id"] for e in AuditReader(directory).query("product")] == [1, 1, 3]
+        finally:
+            log.close()
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+class TestIdempotencyKeys:
+    """Test Idempotency-Key handling on write endpoints"""
+
+    def test_retried_movement_is_not_applied_twice(self, server):
+        """Test that a retried sale replays the first response"""
+        product_id = requests.post(
+            f"{server}/api/products",
+            json={"sku": "IDEM001", "name": "Idempotent Product"}
+        ).json()["id"]
+        requests.post(
+            f"{server}/api/movements",
+            json={"product_id": product_id, "type": "entry", "quantity": 10}
+        )
+        sale = {"product_id": product_id, "type": "sale", "quantity": 3}
+        headers = {"Idempotency-Key": "idem-sale-1"}
+        first = requests.post(f"{server}/api/movements", json=sale, headers=headers)
+        retry = requests.post(f"{server}/api/movements", json=sale, headers=headers)
+        assert first.status_code == retry.status_code == 200
+        assert retry.json() == first.json()
+        assert retry.headers.get("idempotent-replayed") == "true"
+        assert requests.get(f"{server}/api/products/{product_id}").json()["stock"] == 7
+
+    def test_retried_product_create_replays(self, server):
+        """Test that a retried product create doesn't hit the SKU conflict"""
+        payload = {"sku": "IDEM002", "name": "Created Once"}
+        headers = {"Idempotency-Key": "idem-product-1"}
+        first = requests.post(f"{server}/api/products", json=payload, headers=headers)
+        retry = requests.post(f"{server}/api/products", json=payload, headers=headers)
+        assert retry.status_code == 200
+        assert retry.json()["id"] == first.json()["id"]
+
+    def test_key_reuse_with_different_payload(self, server):
+        """Test that reusing a key for a different request is rejected"""
+        headers = {"Idempotency-Key": "idem-supplier-1"}
+        requests.post(f"{server}/api/suppliers", json={"name": "First"}, headers=headers)
+        response = requests.post(f"{server}/api/suppliers", json={"name": "Second"}, headers=headers)
+        assert response.status_code == 422
+
+    def test_key_claimed_by_another_worker(self, server):
+        """Test that a key another process is still running is refused, then usable once the claim expires"""
+        conn = sqlite3.connect("test_inventory.db")
+        conn.execute(
+            "INSERT INTO idempotency_keys (key, fingerprint, status_code, headers, body, created_at) "
+            "VALUES ('idem-claimed-1', '', 0, '[]', x'', ?)",
+            (time.time(),)
+        )
+        conn.commit()
+        headers = {"Idempotency-Key": "idem-claimed-1"}
+        response = requests.post(f"{server}/api/suppliers", json={"name": "Claimed"}, headers=headers)
+        assert response.status_code == 409
+
+        conn.execute("UPDATE idempotency_keys SET created_at = 0 WHERE key = 'idem-claimed-1'")
+        conn.commit()
+        conn.close()
+        response = requests.post(f"{server}/api/suppliers", json={"name": "Claimed"}, headers=headers)
+        assert response.status_code == 200
+
+
+class TestBackupAPI:
+    """Test online backups and snapshot export/restore"""
+
+    def test_online_backup_reports_progress(self, server):
+        """Test that a background backup runs to completion with step timings"""
+        response = requests.post(f"{server}/api/backups", json={"pages": 1, "sleep": 0})
+        assert response.status_code == 200
+        job_id = response.json()["id"]
+        for _ in range(50):
+            job = requests.get(f"{server}/api/backups/{job_id}").json()
+            if job["status"] != "running":
+                break
+            time.sleep(0.1)
+        assert job["status"] == "done"
+        assert job["pages_remaining"] == 0
+        assert len(job["steps"]) == job["pages_total"]
+        assert os.path.exists(job["target"])
+
+    def test_snapshot_export_and_restore(self, server):
+        """Test exporting a gzip snapshot and restoring it"""
+        product_id = requests.post(
+            f"{server}/api/products",
+            json={"sku": "SNAP001", "name": "Snapshot Product"}
+        ).json()["id"]
+        response = requests.get(f"{server}/api/snapshot")
+        assert response.status_code == 200
+        assert response.content[:2] == b"\x1f\x8b"
+
+        response = requests.post(
+            f"{server}/api/snapshot/restore",
+            files={"file": ("snapshot.db.gz", response.content)}
+        )
+        assert response.status_code == 200
+        assert response.json()["status"] == "done"
+        assert requests.get(f"{server}/api/products/{product_id}").status_code == 200
+        assert requests.post(f"{server}/api/scan", json={"code": "SNAP001"}).status_code == 200
+
+    def test_restore_rejects_invalid_snapshot(self, server):
+        """Test that a file that isn't a snapshot leaves the database alone"""
+        response = requests.post(
+            f"{server}/api/snapshot/restore",
+            files={"file": ("snapshot.db.gz", b"not a snapshot")}
+        )
+        assert response.status_code == 400
+        assert requests.get(f"{server}/api/products").status_code == 200
+
+    def test_restore_migrates_old_snapshot(self, server):
+        """Test restoring a snapshot from before the newer tables, over HTTP and the CLI"""
+        requests.post(f"{server}/api/products", json={"sku": "SNAP002", "name": "Before Restore"})
+        current = requests.get(f"{server}/api/snapshot").content
+
+        workdir = tempfile.mkdtemp(prefix="old-snapshot-")
+        try:
+            old_db = os.path.join(workdir, "old.db")
+            conn = sqlite3.connect(old_db)
+            conn.executescript("""
+                CREATE TABLE products (id INTEGER PRIMARY KEY, sku VARCHAR NOT NULL UNIQUE, name VARCHAR NOT NULL,
+                    category VARCHAR, subcategory VARCHAR, cost_price FLOAT, sale_price FLOAT, stock INTEGER);
+                CREATE TABLE suppliers (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, contact VARCHAR,
+                    phone VARCHAR, address VARCHAR);
+                CREATE TABLE inventory_movements (id INTEGER PRIMARY KEY, product_id INTEGER NOT NULL,
+                    type VARCHAR NOT NULL, quantity INTEGER NOT NULL, date DATETIME, supplier_id INTEGER, notes TEXT);
+                INSERT INTO products VALUES (1, 'OLD001', 'Old Product', NULL, NULL, 1.0, 2.0, 7);
+            """)
+            conn.commit()
+            conn.close()
+            with open(old_db, "rb") as raw:
+                old_snapshot = gzip.compress(raw.read())
+
+            with requests.get(f"{server}/api/stock/stream", stream=True, timeout=5) as stream:
+                lines = stream.iter_lines(decode_unicode=True)
+                next(lines)
+                response = requests.post(
+                    f"{server}/api/snapshot/restore",
+                    files={"file": ("old.db.gz", old_snapshot)}
+                )
+                assert response.status_code == 200
+                assert next(line for line in lines if line.startswith("event:")) == "event: resync"
+
+            assert requests.post(f"{server}/api/scan", json={"code": "OLD001"}).json()["product_id"] == 1
+            assert requests.post(f"{server}/api/scan", json={"code": "SNAP002"}).status_code == 404
+            response = requests.post(f"{server}/api/products", json={"sku": "OLD002", "name": "After Restore"})
+            assert response.status_code == 200
+
+            # Put the previous data back from the command line; the running server picks it up
+            current_path = os.path.join(workdir, "current.db.gz")
+            with open(current_path, "wb") as f:
+                f.write(current)
+            subprocess.run(["python3", "backup.py", "restore", current_path], check=True, capture_output=True)
+            for _ in range(20):
+                if requests.post(f"{server}/api/scan", json={"code": "SNAP002"}).status_code == 200:
+                    break
+                time.sleep(0.1)
+            else:
+                pytest.fail("Barcode index was not reloaded after the CLI restore")
+            assert requests.post(f"{server}/api/scan", json={"code": "OLD001"}).status_code == 404
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+class TestPurchaseOrdersAPI:
+    """Test purchase orders and goods receipts"""
+
+    def _order(self, server, lines):
+        supplier_id = requests.post(
+            f"{server}/api/suppliers",
+            json={"name": "PO Supplier"}
+        ).json()["id"]
+        product_ids = []
+        for i, (quantity, unit_cost) in enumerate(lines):
+            product_ids.append(requests.post(
+                f"{server}/api/products",
+                json={"sku": f"PO-{supplier_id}-{i}", "name": f"PO Product {i}"}
+            ).json()["id"])
+        response = requests.post(
+            f"{server}/api/purchase-orders",
+            json={
+                "supplier_id": supplier_id,
+                "lines": [
+                    {"product_id": pid, "quantity": quantity, "unit_cost": unit_cost}
+                    for pid, (quantity, unit_cost) in zip(product_ids, lines)
+                ]
+            }
+        )
+        assert response.status_code == 200
+        return response.json(), product_ids
+
+    def test_partial_then_full_receipt(self, server):
+        """Test that receipts post stock and track outstanding quantities"""
+        order, (first, second) = self._order(server, [(10, 2.0), (5, 4.0)])
+        assert order["status"] == "open"
+
+        response = requests.post(
+            f"{server}/api/purchase-orders/{order['id']}/receipts",
+            json={"lines": [{"product_id": first, "quantity": 4}]}
+        )
+        assert response.status_code == 200
+        assert response.json()["status"] == "partial"
+        assert requests.get(f"{server}/api/products/{first}").json()["stock"] == 4
+
+        open_orders = requests.get(f"{server}/api/purchase-orders/open").json()
+        summary = next(o for o in open_orders if o["id"] == order["id"])
+        assert summary["quantity_outstanding"] == 11
+        assert summary["value_outstanding"] == 32.0
+
+        # Receive everything that is left in one request
+        response = requests.post(f"{server}/api/purchase-orders/{order['id']}/receipts", json={})
+        assert response.status_code == 200
+        receipt = response.json()
+        assert receipt["status"] == "received"
+        assert {l["product_id"]: l["quantity"] for l in receipt["lines"]} == {first: 6, second: 5}
+        assert requests.get(f"{server}/api/products/{first}").json()["stock"] == 10
+        assert requests.get(f"{server}/api/products/{second}").json()["stock"] == 5
+
+        movement = requests.get(f"{server}/api/movements/{receipt['lines'][0]['movement_id']}").json()
+        assert movement["type"] == "entry"
+        assert movement["supplier_id"] == order["supplier_id"]
+
+        open_ids = [o["id"] for o in requests.get(f"{server}/api/purchase-orders/open").json()]
+        assert order["id"] not in open_ids
+
+    def test_over_receipt_is_rejected(self, server):
+        """Test that receiving more than ordered changes nothing"""
+        order, (product_id,) = self._order(server, [(3, 1.0)])
+        response = requests.post(
+            f"{server}/api/purchase-orders/{order['id']}/receipts",
+            json={"lines": [{"product_id": product_id, "quantity": 4}]}
+        )
+        assert response.status_code == 400
+        assert requests.get(f"{server}/api/products/{product_id}").json()["stock"] == 0
+        assert requests.get(f"{server}/api/purchase-orders/{order['id']}").json()["status"] == "open"
+
+    def test_products_on_open_orders(self, server):
+        """Test that ordered products can't be deleted and deleted ones aren't received"""
+        order, (kept, removed) = self._order(server, [(2, 1.0), (3, 1.0)])
+        response = requests.delete(f"{server}/api/products/{removed}")
+        assert response.status_code == 409
+
+        # Databases from before the check may already have such lines
+        conn = sqlite3.connect("test_inventory.db")
+        conn.execute("DELETE FROM products WHERE id = ?", (removed,))
+        conn.commit()
+        conn.close()
+        response = requests.post(f"{server}/api/purchase-orders/{order['id']}/receipts", json={})
+        assert response.status_code == 409
+        assert requests.get(f"{server}/api/products/{kept}").json()["stock"] == 0
+
+
 class TestIntegration:
     """Integration tests combining multiple operations"""
     
@@ -352,3 +921,446 @@ class TestIntegration:
         # Check final stock
         product = requests.get(f"{server}/api/products/{product_id}").json()
         assert product["stock"] == 65
+
+
+@pytest.fixture(scope="module")
+def multi_worker_server():
+    """Start the app with two worker processes on a scratch database"""
+    workdir = tempfile.mkdtemp(prefix="workers-")
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'inventory.db')}",
+        AUDIT_DIR=os.path.join(workdir, "audit"),
+        BACKUP_DIR=os.path.join(workdir, "backups"),
+    )
+    process = subprocess.Popen(
+        ["python3", "serve.py", "--workers", "2", "--host", "127.0.0.1", "--port", "8889", "--log-level", "warning"],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    for i in range(60):
+        try:
+            response = requests.get("http://127.0.0.1:8889/api/products", timeout=1)
+            if response.status_code == 200:
+                break
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.5)
+    else:
+        process.kill()
+        pytest.fail("Server failed to start")
+
+    yield "http://127.0.0.1:8889"
+
+    process.send_signal(signal.SIGTERM)
+    process.wait(timeout=10)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+class TestMultiWorker:
+    """Test a deployment with several worker processes"""
+
+    def test_plain_uvicorn_workers_start_on_fresh_database(self):
+        """Test that workers initialising the same new database one after another all start"""
+        workdir = tempfile.mkdtemp(prefix="uvicorn-workers-")
+        env = dict(
+            os.environ,
+            DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'inventory.db')}",
+            AUDIT_DIR=os.path.join(workdir, "audit"),
+            BACKUP_DIR=os.path.join(workdir, "backups"),
+            INVENTORY_WORKERS="4",
+        )
+        process = subprocess.Popen(
+            ["python3", "-m", "uvicorn", "main:app", "--workers", "4", "--host", "127.0.0.1", "--port", "8892"],
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True
+        )
+        output = []
+        watchdog = threading.Timer(60, process.kill)
+        watchdog.start()
+        try:
+            for line in process.stdout:
+                output.append(line)
+                if sum("Application startup complete" in l for l in output) == 4 or "Traceback" in line:
+                    break
+        finally:
+            watchdog.cancel()
+            process.send_signal(signal.SIGTERM)
+            process.wait(timeout=20)
+            shutil.rmtree(workdir, ignore_errors=True)
+        assert sum("Application startup complete" in l for l in output) == 4, "".join(output)
+
+    def test_concurrent_sales_are_serialized(self, multi_worker_server):
+        """Test that concurrent writes across workers neither fail nor lose updates"""
+        server = multi_worker_server
+        product_id = requests.post(
+            f"{server}/api/products",
+            json={"sku": "MW001", "name": "Multi Worker Product"}
+        ).json()["id"]
+        requests.post(
+            f"{server}/api/movements",
+            json={"product_id": product_id, "type": "entry", "quantity": 100}
+        )
+        statuses = []
+
+        def sell():
+            for _ in range(5):
+                response = requests.post(
+                    f"{server}/api/movements",
+                    json={"product_id": product_id, "type": "sale", "quantity": 1}
+                )
+                statuses.append(response.status_code)
+
+        threads = [threading.Thread(target=sell) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert statuses == [200] * 40
+        assert requests.get(f"{server}/api/products/{product_id}").json()["stock"] == 60
+
+    def test_slow_client_does_not_block_writes(self, multi_worker_server):
+        """Test that a request still sending its body holds no lock"""
+        server = multi_worker_server
+        product_id = requests.post(
+            f"{server}/api/products",
+            json={"sku": "MW004", "name": "Slow Client Product"}
+        ).json()["id"]
+        slow = socket.create_connection(("127.0.0.1", 8889))
+        try:
+            slow.sendall(
+                b"POST /api/products HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+                b"Content-Type: application/json\r\nContent-Length: 1000\r\n\r\n{\"sku\": "
+            )
+            for _ in range(4):
+                response = requests.post(
+                    f"{server}/api/movements",
+                    json={"product_id": product_id, "type": "entry", "quantity": 1},
+                    timeout=2
+                )
+                assert response.status_code == 200
+        finally:
+            slow.close()
+
+    def test_scan_index_is_coherent_across_workers(self, multi_worker_server):
+        """Test that a barcode added on one worker resolves on every worker"""
+        server = multi_worker_server
+        product_id = requests.post(
+            f"{server}/api/products",
+            json={"sku": "MW002", "name": "Coherent Product"}
+        ).json()["id"]
+        requests.post(
+            f"{server}/api/products/{product_id}/barcodes",
+            json={"barcode": "MW002-ALT"}
+        )
+        time.sleep(0.5)
+        for _ in range(20):
+            # A fresh connection per request so both workers get a turn
+            response = requests.post(f"{server}/api/scan", json={"code": "MW002-ALT"})
+            assert response.status_code == 200
+            assert response.json()["product_id"] == product_id
+
+    def test_stream_sees_writes_from_any_worker(self, multi_worker_server):
+        """Test that SSE subscribers get deltas for commits made by other workers"""
+        server = multi_worker_server
+        product_id = requests.post(
+            f"{server}/api/products",
+            json={"sku": "MW003", "name": "Streamed Across Workers"}
+        ).json()["id"]
+        with requests.get(
+            f"{server}/api/stock/stream",
+            params={"product_id": product_id},
+            stream=True,
+            timeout=5
+        ) as stream:
+            lines = stream.iter_lines(decode_unicode=True)
+            next(lines)
+            for quantity in range(1, 5):
+                requests.post(
+                    f"{server}/api/movements",
+                    json={"product_id": product_id, "type": "entry", "quantity": quantity}
+                )
+            stock = None
+            for line in lines:
+                if line.startswith("data: "):
+                    stock = json.loads(line[len("data: "):])[-1]["stock"]
+                    if stock == 10:
+                        break
+        assert stock == 10
+
+
+@pytest.fixture(scope="module")
+def postgres():
+    """Start a throwaway PostgreSQL server; yields a function creating fresh databases"""
+    pgserver = pytest.importorskip("pgserver")
+    pytest.importorskip("psycopg2")
+    datadir = tempfile.mkdtemp(prefix="pgdata-")
+    pg = pgserver.get_server(datadir, cleanup_mode="stop")
+    names = iter(range(1, 1000))
+
+    def create_database():
+        name = f"inventory_test_{next(names)}"
+        pg.psql(f"CREATE DATABASE {name};")
+        return pg.get_uri(name)
+
+    yield create_database
+
+    pg.cleanup()
+    shutil.rmtree(datadir, ignore_errors=True)
+
+
+@pytest.fixture(scope="module")
+def postgres_server(postgres):
+    """Start the app with two worker processes on a fresh PostgreSQL database"""
+    workdir = tempfile.mkdtemp(prefix="pg-workers-")
+    database_url = postgres()
+    env = dict(
+        os.environ,
+        DATABASE_URL=database_url,
+        AUDIT_DIR=os.path.join(workdir, "audit"),
+        BACKUP_DIR=os.path.join(workdir, "backups"),
+        DB_POOL_SIZE="5",
+    )
+    process = subprocess.Popen(
+        ["python3", "serve.py", "--workers", "2", "--host", "127.0.0.1", "--port", "8891", "--log-level", "warning"],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    for i in range(60):
+        try:
+            response = requests.get("http://127.0.0.1:8891/api/products", timeout=1)
+            if response.status_code == 200:
+                break
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.5)
+    else:
+        process.kill()
+        pytest.fail("Server failed to start")
+
+    yield "http://127.0.0.1:8891", database_url
+
+    process.send_signal(signal.SIGTERM)
+    process.wait(timeout=10)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _run_migrations(database_url, *args):
+    return subprocess.run(
+        ["python3", "migrations.py", *args],
+        env=dict(os.environ, DATABASE_URL=database_url),
+        capture_output=True,
+        text=True,
+        check=True
+    ).stdout
+
+
+class TestPostgresBackend:
+    """Test running on PostgreSQL, migrations and the SQLite copy tool"""
+
+    def test_concurrent_sales_lock_the_product_row(self, postgres_server):
+        """Test that concurrent sales on two workers don't lose updates"""
+        server, _ = postgres_server
+        product_id = requests.post(
+            f"{server}/api/products",
+            json={"sku": "PG001", "name": "Postgres Product"}
+        ).json()["id"]
+        requests.post(
+            f"{server}/api/movements",
+            json={"product_id": product_id, "type": "entry", "quantity": 100}
+        )
+        statuses = []
+
+        def sell():
+            for _ in range(5):
+                response = requests.post(
+                    f"{server}/api/movements",
+                    json={"product_id": product_id, "type": "sale", "quantity": 1}
+                )
+                statuses.append(response.status_code)
+
+        threads = [threading.Thread(target=sell) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert statuses == [200] * 40
+        assert requests.get(f"{server}/api/products/{product_id}").json()["stock"] == 60
+
+    def test_listings_stream_every_row(self, postgres_server):
+        """Test that streamed listings return complete, ordered JSON arrays"""
+        server, _ = postgres_server
+        for i in range(3):
+            requests.post(
+                f"{server}/api/products",
+                json={"sku": f"PGL{i}", "name": f"Listed {i}", "sale_price": 1.5}
+            )
+        response = requests.get(f"{server}/api/products")
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/json"
+        products = response.json()
+        names = [p["name"] for p in products]
+        assert names == sorted(names)
+        assert {"Listed 0", "Listed 1", "Listed 2"} <= set(names)
+        movements = requests.get(f"{server}/api/movements").json()
+        assert len(movements) >= 41
+        assert "date" in movements[0]
+
+    def test_barcode_scan_is_coherent_across_workers(self, postgres_server):
+        """Test that the watcher reloads barcodes on every worker without data_version"""
+        server, _ = postgres_server
+        product_id = requests.post(
+            f"{server}/api/products",
+            json={"sku": "PG002", "name": "Scanned On Postgres"}
+        ).json()["id"]
+        requests.post(f"{server}/api/products/{product_id}/barcodes", json={"barcode": "7500000000991"})
+        time.sleep(0.5)
+        for _ in range(10):
+            response = requests.post(f"{server}/api/scan", json={"code": "7500000000991"})
+            assert response.status_code == 200
+            assert response.json()["product_id"] == product_id
+
+    def test_stream_sees_concurrent_writes(self, postgres_server):
+        """Test that SSE subscribers get the final stock after concurrent commits"""
+        server, _ = postgres_server
+        product_id = requests.post(
+            f"{server}/api/products",
+            json={"sku": "PG003", "name": "Streamed On Postgres"}
+        ).json()["id"]
+        with requests.get(
+            f"{server}/api/stock/stream",
+            params={"product_id": product_id},
+            stream=True,
+            timeout=5
+        ) as stream:
+            lines = stream.iter_lines(decode_unicode=True)
+            next(lines)
+            threads = [
+                threading.Thread(target=requests.post, args=(f"{server}/api/movements",), kwargs={
+                    "json": {"product_id": product_id, "type": "entry", "quantity": 1}
+                })
+                for _ in range(10)
+            ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            stock = None
+            for line in lines:
+                if line.startswith("data: "):
+                    stock = json.loads(line[len("data: "):])[-1]["stock"]
+                    if stock == 10:
+                        break
+        assert stock == 10
+
+    def test_concurrent_receipts_post_once(self, postgres_server):
+        """Test that racing "receive all" requests don't count a delivery twice"""
+        server, _ = postgres_server
+        supplier_id = requests.post(f"{server}/api/suppliers", json={"name": "PG Supplier"}).json()["id"]
+        product_id = requests.post(
+            f"{server}/api/products",
+            json={"sku": "PG004", "name": "Received On Postgres"}
+        ).json()["id"]
+        order_id = requests.post(
+            f"{server}/api/purchase-orders",
+            json={"supplier_id": supplier_id, "lines": [{"product_id": product_id, "quantity": 12}]}
+        ).json()["id"]
+        statuses = []
+
+        def receive_all():
+            statuses.append(requests.post(f"{server}/api/purchase-orders/{order_id}/receipts", json={}).status_code)
+
+        threads = [threading.Thread(target=receive_all) for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert sorted(statuses) == [200] + [400] * 5
+        assert requests.get(f"{server}/api/products/{product_id}").json()["stock"] == 12
+        order = requests.get(f"{server}/api/purchase-orders/{order_id}").json()
+        assert order["lines"][0]["quantity_received"] == 12
+
+    def test_concurrent_idempotent_requests(self, postgres_server):
+        """Test that one key sent to both workers at once runs once and never fails"""
+        server, _ = postgres_server
+        product_id = requests.post(
+            f"{server}/api/products",
+            json={"sku": "PG005", "name": "Idempotent On Postgres"}
+        ).json()["id"]
+        for attempt in range(5):
+            statuses = []
+            barrier = threading.Barrier(8)
+
+            def send():
+                barrier.wait()
+                statuses.append(requests.post(
+                    f"{server}/api/movements",
+                    json={"product_id": product_id, "type": "entry", "quantity": 1},
+                    headers={"Idempotency-Key": f"pg-idem-{attempt}"}
+                ).status_code)
+
+            threads = [threading.Thread(target=send) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            assert set(statuses) <= {200, 409}
+            assert 200 in statuses
+        assert requests.get(f"{server}/api/products/{product_id}").json()["stock"] == 5
+
+    def test_migrations_are_recorded(self, postgres_server):
+        """Test that startup applied every migration, including the indexes"""
+        _, database_url = postgres_server
+        status = _run_migrations(database_url, "status")
+        assert "pending" not in status
+        assert "indexes for hot queries" in status
+        assert "up to date" in _run_migrations(database_url, "upgrade")
+
+    def test_copy_sqlite_database(self, postgres):
+        """Test bulk copying an SQLite database into a fresh PostgreSQL database"""
+        workdir = tempfile.mkdtemp(prefix="copy-")
+        source = f"sqlite:///{os.path.join(workdir, 'inventory.db')}"
+        target = postgres()
+        try:
+            _run_migrations(source, "upgrade")
+            conn = sqlite3.connect(os.path.join(workdir, "inventory.db"))
+            conn.executemany(
+                "INSERT INTO products (id, sku, name, cost_price, sale_price, stock) VALUES (?, ?, ?, 1.0, 2.0, ?)",
+                [(i, f"CP{i:04d}", f"Copied {i}", i) for i in range(1, 251)]
+            )
+            conn.executemany(
+                "INSERT INTO inventory_movements (product_id, type, quantity, date) VALUES (?, 'entry', ?, '2024-01-01 00:00:00')",
+                [(i, i) for i in range(1, 251)]
+            )
+            conn.commit()
+            conn.close()
+
+            output = _run_migrations(source, "copy", "--source", source, "--target", target, "--batch-size", "100")
+            assert "products: 250 rows" in output
+            assert "inventory_movements: 250 rows" in output
+
+            engine = create_engine(target)
+            with engine.begin() as conn:
+                assert conn.execute(text("SELECT SUM(stock) FROM products")).scalar() == sum(range(1, 251))
+                # Sequences continue after the copied ids
+                new_id = conn.execute(text(
+                    "INSERT INTO products (sku, name, cost_price, sale_price, stock) "
+                    "VALUES ('CPNEW', 'New', 0, 0, 0) RETURNING id"
+                )).scalar()
+                assert new_id == 251
+            engine.dispose()
+
+            # A second copy into the same target is refused
+            result = subprocess.run(
+                ["python3", "migrations.py", "copy", "--source", source, "--target", target],
+                capture_output=True,
+                text=True
+            )
+            assert result.returncode != 0
+            assert "not empty" in result.stderr
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,252 @@
+"""
+Support for running several uvicorn worker processes on one database.
+
+- On SQLite writes are serialized: inside a process by an asyncio lock, across
+  processes by an exclusive ``flock`` on ``<database>.writelock``. Write routes
+  are wrapped in ``serialized_write``, so the lock covers only the route body,
+  after the request was parsed and before the response is sent; a slow client
+  never holds it. Reads never take it. PostgreSQL handles concurrent writers
+  itself (stock changes lock the product row), so there routes aren't wrapped.
+- Each worker runs a ``DataVersionWatcher``; when another worker has committed
+  it reloads the barcode index (if the catalog version moved) and forwards new
+  movements to the stock broker.
+
+The watcher always runs, so a restore made from the command line reaches a
+running server; it only forwards movements when ``INVENTORY_WORKERS`` is greater
+than 1 (``serve.py`` sets it). ``fcntl`` is not available on Windows, where
+only the in-process lock applies and a single worker should be used.
+"""
+import asyncio
+import functools
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from database import SessionLocal, engine
+import models
+from checkout import barcode_index
+from stock_events import stock_broker, stock_delta
+
+WORKER_COUNT = int(os.environ.get("INVENTORY_WORKERS", "1"))
+GAP_TIMEOUT = 5.0
+
+
+def _sqlite_path():
+    if engine.url.get_backend_name() != "sqlite":
+        return None
+    return engine.url.database
+
+
+class WriteLock:
+    def __init__(self, path):
+        self.path = path
+        self._async_lock = None
+        self._thread_lock = threading.Lock()
+        self._fd = None
+
+    def _acquire(self):
+        # flock doesn't exclude other threads using the same descriptor, hence the thread lock.
+        self._thread_lock.acquire()
+        if fcntl is None or self.path is None:
+            return
+        try:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        except BaseException:
+            self._thread_lock.release()
+            raise
+
+    def _release(self):
+        try:
+            if self._fd is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            self._thread_lock.release()
+
+    @asynccontextmanager
+    async def hold(self):
+        """Hold the write lock from async code; queued requests wait without using a thread."""
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        async with self._async_lock:
+            await run_in_threadpool(self._acquire)
+            try:
+                yield
+            finally:
+                self._release()
+
+    @contextmanager
+    def hold_sync(self):
+        """Hold the write lock from a worker thread or a command line tool."""
+        self._acquire()
+        try:
+            yield
+        finally:
+            self._release()
+
+
+_db_path = _sqlite_path()
+write_lock = WriteLock(_db_path + ".writelock" if _db_path else None)
+
+
+def serialized_write(func):
+    """Run a sync write route one at a time across all worker processes.
+
+    Put it under the ``@router`` decorator. FastAPI has parsed the request by the
+    time the route is called, and sends the response after it returns, so the
+    lock is never held while waiting on the client. Queued requests wait on the
+    asyncio lock instead of occupying threadpool threads.
+    """
+    if write_lock.path is None:
+        return func
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        async with write_lock.hold():
+            return await run_in_threadpool(func, *args, **kwargs)
+
+    return wrapper
+
+
+def bump_catalog_version(db: Session):
+    """Mark products/barcodes as changed; call before committing such a change."""
+    db.query(models.SyncState).filter_by(name="catalog").update(
+        {models.SyncState.version: models.SyncState.version + 1}, synchronize_session=False
+    )
+
+
+class DataVersionWatcher:
+    """Forwards other workers' commits to this worker's barcode index and stock broker.
+
+    A restore (``sync_state`` row ``restore``) resets the movement cursor and asks
+    stream subscribers to resync. On SQLite ``PRAGMA data_version`` tells cheaply whether anything was committed
+    by another connection; PostgreSQL has no equivalent, so there every tick
+    reads the catalog version and the newest movement id (both index lookups).
+    """
+
+    def __init__(self, engine, interval: float = 0.05, follow_movements: bool = True):
+        self.engine = engine
+        self.interval = interval
+        self.follow_movements = follow_movements
+        self._sqlite = engine.url.get_backend_name() == "sqlite"
+        self._stop = threading.Event()
+        self._thread = None
+        self._conn = None
+        self._data_version = None
+        self._catalog_version = None
+        self._restore_version = None
+        self._last_movement_id = 0
+        # Ids skipped over by the last polls, with when they were first missed.
+        # Concurrent PostgreSQL transactions can commit a lower id after a higher
+        # one; ids still missing after GAP_TIMEOUT were rolled back.
+        self._gaps = {}
+
+    def start(self):
+        if self._thread:
+            return
+        # Held for the watcher's lifetime: data_version is per connection, and
+        # autocommit means every poll sees the latest committed state.
+        self._conn = self.engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+        self._data_version = self._read_data_version()
+        versions = self._read_sync_versions()
+        self._catalog_version = versions.get("catalog", 0)
+        self._restore_version = versions.get("restore", 0)
+        self._last_movement_id = self._read_max_movement_id()
+        if self.follow_movements:
+            # Movements are published only from here, so each commit reaches every
+            # worker's subscribers exactly once whichever worker made it.
+            stock_broker.external_feed = True
+        self._thread = threading.Thread(target=self._run, name="data-version-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self._thread:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._conn.close()
+        stock_broker.external_feed = False
+
+    def _read_data_version(self):
+        if not self._sqlite:
+            return None
+        return self._conn.exec_driver_sql("PRAGMA data_version").scalar()
+
+    def _read_sync_versions(self):
+        return dict(self._conn.execute(text("SELECT name, version FROM sync_state")).fetchall())
+
+    def _read_max_movement_id(self):
+        return self._conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM inventory_movements")).scalar()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except DBAPIError:
+                # Busy, mid-restore or the server went away; try again on the next tick.
+                continue
+
+    def poll(self):
+        if self._sqlite:
+            data_version = self._read_data_version()
+            if data_version == self._data_version:
+                return
+            self._data_version = data_version
+        versions = self._read_sync_versions()
+        catalog_version = versions.get("catalog", 0)
+        if catalog_version != self._catalog_version:
+            self._catalog_version = catalog_version
+            db = SessionLocal()
+            barcode_index.load(db)
+            db.close()
+        restore_version = versions.get("restore", 0)
+        if restore_version != self._restore_version:
+            # Every stock value may have changed and movement ids may have gone
+            # back; start over from the restored data.
+            self._restore_version = restore_version
+            self._last_movement_id = self._read_max_movement_id()
+            self._gaps.clear()
+            stock_broker.resync()
+            return
+        if not self.follow_movements:
+            return
+        max_id = self._read_max_movement_id()
+        now = time.monotonic()
+        self._gaps = {mid: seen for mid, seen in self._gaps.items() if now - seen < GAP_TIMEOUT}
+        if max_id == self._last_movement_id and not self._gaps:
+            return
+        query = (
+            "SELECT m.id, m.product_id, p.stock FROM inventory_movements m "
+            "JOIN products p ON p.id = m.product_id WHERE m.id > :last"
+        )
+        params = {"last": self._last_movement_id}
+        if self._gaps:
+            query += " OR m.id IN (" + ", ".join(str(mid) for mid in self._gaps) + ")"
+        rows = self._conn.execute(text(query + " ORDER BY m.id"), params).fetchall()
+        if not rows:
+            return
+        expected = self._last_movement_id + 1
+        for mid, _, _ in rows:
+            if mid > self._last_movement_id:
+                self._gaps.update((gap, now) for gap in range(expected, mid))
+                expected = mid + 1
+            else:
+                del self._gaps[mid]
+        self._last_movement_id = max(self._last_movement_id, rows[-1][0])
+        stock_broker.publish([stock_delta(pid, stock, mid) for mid, pid, stock in rows], external=True)
+
+
+watcher = DataVersionWatcher(engine, follow_movements=WORKER_COUNT > 1)